@@ -1,10 +1,21 @@
 from flask import Flask, jsonify, request, send_from_directory, Response, render_template_string
+from werkzeug.middleware.proxy_fix import ProxyFix
 import threading
 import os, logging
+import hmac
 import json
 import time
-from seat import TicketBooking
-from queue import Queue, Empty
+from datetime import datetime
+from seat import TicketBooking, is_show_date
+from hold_expiry import HoldExpiryScheduler
+from storage import inventory_factory, lock_storage
+from idempotency import IdempotencyCache
+from wal import WriteAheadLog
+from snapshot import Snapshotter
+from waiting_room import WaitingRoom
+from engine import BookingEngine
+from events import EventBroadcaster
+from queue import Empty
 from payment import payment_system
 
 # Configure logging
@@ -21,7 +32,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-booking_events = Queue()
+# Behind TRUSTED_PROXY_HOPS reverse proxies, the client address (used in
+# logs and for the per-client hold quota) is taken from the
+# X-Forwarded-For entry the outermost trusted proxy added. Without it
+# every request seems to come from the proxy, so all customers would
+# share one quota. Only set it when the proxies overwrite or append to
+# that header, or clients could claim any address.
+trusted_proxy_hops = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if trusted_proxy_hops:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxy_hops)
+# Every event goes to every connected SSE client
+booking_events = EventBroadcaster()
 
 # Configure Flask's logger
 app.logger.setLevel(logging.INFO)
@@ -29,18 +50,25 @@ app.logger.setLevel(logging.INFO)
 # ... (existing event stream logic remains unchanged) ...
 def event_stream(client_id):
     logger.info(f"New SSE client connected: {client_id}")
+    events = booking_events.subscribe()
     
-    while True:
-        try:
-            event = booking_events.get(timeout=10)
-            logger.debug(f"Sending event to client {client_id}: {event}")
-            yield f'data: {json.dumps(event)}\n\n'
-        except Empty:
-            logger.debug(f"Sending ping to client {client_id}")
-            yield 'data: {"event": "ping"}\n\n'
-        except Exception as e:
-            logger.error(f"Error in event stream for client {client_id}: {str(e)}")
-            break
+    try:
+        while True:
+            try:
+                event = events.get(timeout=10)
+                logger.debug(f"Sending event to client {client_id}: {event}")
+                yield f'data: {json.dumps(event)}\n\n'
+            except Empty:
+                if not booking_events.subscribed(events):
+                    # Cut off for falling behind; the browser reconnects
+                    break
+                logger.debug(f"Sending ping to client {client_id}")
+                yield 'data: {"event": "ping"}\n\n'
+            except Exception as e:
+                logger.error(f"Error in event stream for client {client_id}: {str(e)}")
+                break
+    finally:
+        booking_events.unsubscribe(events)
     
     logger.info(f"SSE client disconnected: {client_id}")
 
@@ -50,15 +78,192 @@ def stream():
     logger.info(f"SSE stream requested by {client_id}")
     return Response(event_stream(client_id), mimetype="text/event-stream")
 
-handler = TicketBooking()
+def release_expired_holds(session_ids):
+    """Hand seats of unpaid, expired payment sessions back to the pool"""
+    released = handler.expire_holds(session_ids)
+    for date, seats in released.items():
+        logger.info(f"Released {len(seats)} expired holds for {date}")
+        booking_events.put({
+            "event": "seats_released",
+            "timestamp": time.time(),
+            "date": date,
+            "seats": seats
+        })
+
+hold_expiry = HoldExpiryScheduler(release_expired_holds)
+
+# Leaving the payment page cancels its hold LEAVE_GRACE_SECONDS later,
+# unless the page is loaded again first: a reload fires the same pagehide
+# event as leaving for good.
+LEAVE_GRACE_SECONDS = 10
+left_pages = {}  # session_id -> (cancel token, deadline) of payment pages just left
+
+def release_abandoned_holds(session_ids):
+    """Cancel the holds of payment pages that were left and not reopened"""
+    now = time.time()
+    for session_id in session_ids:
+        left = left_pages.get(session_id)
+        # Reopened, or left again since with a later deadline
+        if left is None or left[1] > now or left_pages.pop(session_id, None) is not left:
+            continue
+        result, _ = cancel_and_announce(session_id, left[0])
+        if result.get('success'):
+            logger.info(f"Released hold of abandoned payment page for session {session_id}")
+
+abandoned_holds = HoldExpiryScheduler(release_abandoned_holds)
+
+def announce_promotion(entry):
+    """Tell every seat map that seats went to a waitlisted customer
+
+    The event goes to everyone, so it leaves out the entry and its payment
+    link; the waiting browser fetches those from its waitlist entry.
+    """
+    logger.info(f"Waitlist entry {entry['waitlist_id']} for {entry['date']} promoted to session {entry['session_id']}")
+    booking_events.put({
+        "event": "waitlist_promoted",
+        "timestamp": time.time(),
+        "date": entry['date'],
+        "seats": entry['seats']
+    })
+
+# Venue size: a JSON layout file (VENUE_LAYOUT) or VENUE_ROWS x VENUE_COLS.
+# The layout file may also list "price_tiers" by row range (PUT /pricing
+# replaces them at runtime); without them every seat costs the default.
+# VENUE_STORAGE picks where seats live: "memory" (default), "shared"
+# memory-mapped files in the VENUE_STORAGE_PATH directory, or a "sqlite"
+# database at VENUE_STORAGE_PATH. The last two keep seats across restarts
+# and let other processes read the seat maps, but payment sessions live in
+# the serving process: run a single worker, as a second one on the same
+# store fails to start.
+storage = os.environ.get('VENUE_STORAGE', 'memory')
+handler = TicketBooking(
+    rows=int(os.environ.get('VENUE_ROWS', 0)) or None,
+    cols=int(os.environ.get('VENUE_COLS', 0)) or None,
+    section_rows=int(os.environ.get('VENUE_SECTION_ROWS', 0)) or None,
+    layout_file=os.environ.get('VENUE_LAYOUT'),
+    hold_expiry=hold_expiry,
+    # Cap on unpaid seats one customer may hold at once (HOLD_QUOTA, 0 = none)
+    max_holds_per_customer=int(os.environ.get('HOLD_QUOTA', 0)) or None,
+    inventory_factory=inventory_factory(storage, os.environ.get('VENUE_STORAGE_PATH')),
+    on_promoted=announce_promotion
+)
+
+# VENUE_ENGINE=single-writer queues every booking write for one writer
+# thread that applies them in batches of up to VENUE_ENGINE_BATCH, so
+# request threads wait on their own command instead of on each other.
+engine = None
+if os.environ.get('VENUE_ENGINE') == 'single-writer':
+    engine = handler = BookingEngine(handler, int(os.environ.get('VENUE_ENGINE_BATCH', 256)))
+
+# VENUE_JOURNAL names a write-ahead log replayed at startup so bookings
+# survive a restart. Commits wait for fsync unless VENUE_JOURNAL_SYNC_MS
+# asks for a flush every N milliseconds instead. The other storage
+# backends are durable already, so the journal only backs "memory".
+# A binary snapshot is written every VENUE_SNAPSHOT_INTERVAL seconds (next
+# to the journal unless VENUE_SNAPSHOT says otherwise) so a restart only
+# replays the journal written since.
+#
+# `python backend.py` runs the debug reloader, which executes this module
+# twice: in a watcher process that only restarts the server on code
+# changes, and in the child (WERKZEUG_RUN_MAIN set) that serves requests.
+# Only the serving process recovers, journals and expires holds.
+reloader_watcher = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+journal_path = os.environ.get('VENUE_JOURNAL')
+if not reloader_watcher:
+    if journal_path and storage == 'memory':
+        # Fails if another process already has the journal open
+        journal = WriteAheadLog(journal_path, int(os.environ.get('VENUE_JOURNAL_SYNC_MS', 0)))
+        snapshot_path = os.environ.get('VENUE_SNAPSHOT', journal_path + '.snapshot')
+        handler.recover(journal, snapshot_path)
+        journal.start()
+        snapshotter = Snapshotter(handler, payment_system, journal, snapshot_path,
+                                  interval=int(os.environ.get('VENUE_SNAPSHOT_INTERVAL', 60)))
+        snapshotter.start()
+    elif storage != 'memory':
+        # Fails if another server already sells from the store
+        storage_lock = lock_storage(storage, os.environ.get('VENUE_STORAGE_PATH'))
+        # The seats outlive a restart but payment sessions don't, so unpaid
+        # holds from the previous run could never be paid or expire
+        released = handler.release_stored_holds()
+        if released:
+            logger.info(f"Released {released} unpaid seats held before the restart")
+    if engine is not None:
+        engine.start()
+    hold_expiry.start()
+    abandoned_holds.start()
+
+# Responses remembered per Idempotency-Key header so client retries and
+# double submits get the first result instead of booking or paying twice
+idempotency = IdempotencyCache(
+    max_entries=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+)
+
+# With WAITING_ROOM_RATE set, POST /booking only serves clients holding an
+# admission token from the waiting room, which lets that many in per
+# second. Tokens last WAITING_ROOM_TOKEN_TTL seconds past a client's turn
+# and each place in line gets one, good for one booking; worker processes
+# accept each other's tokens when they share WAITING_ROOM_SECRET.
+waiting_room = None
+if int(os.environ.get('WAITING_ROOM_RATE', 0)):
+    secret = os.environ.get('WAITING_ROOM_SECRET')
+    waiting_room = WaitingRoom(
+        admit_per_second=int(os.environ['WAITING_ROOM_RATE']),
+        token_ttl=int(os.environ.get('WAITING_ROOM_TOKEN_TTL', 300)),
+        secret=secret.encode() if secret else None
+    )
+
+# Holds are cancelled with a token handed only to the client that placed
+# them. Worker processes accept each other's tokens when they share
+# HOLD_CANCEL_SECRET.
+if os.environ.get('HOLD_CANCEL_SECRET'):
+    payment_system.secret = os.environ['HOLD_CANCEL_SECRET'].encode()
+
+# Admin endpoints (PUT /pricing) want "Authorization: Bearer <ADMIN_TOKEN>";
+# without ADMIN_TOKEN set they are turned off.
+admin_token = os.environ.get('ADMIN_TOKEN')
+
+def is_admin():
+    if not admin_token:
+        return False
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), admin_token.encode())
+
+def idempotent_response(scope, payload, handle):
+    """Run ``handle()`` once per Idempotency-Key within ``scope``
+
+    Without the header the request simply runs. A replayed key returns
+    the stored response, marked with an Idempotent-Replayed header.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        result, status_code = handle()
+        return jsonify(result), status_code
+    
+    result, status_code, replayed = idempotency.run(f"{scope}:{key}", payload, handle)
+    if replayed:
+        logger.info(f"Replaying stored response for Idempotency-Key {key} from {request.remote_addr}")
+    response = jsonify(result)
+    response.status_code = status_code
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
 
 # Custom wrapper functions to add logging
 def book_with_logging():
     client_ip = request.remote_addr
+    # Turned away before any parsing or locking, so a flash crowd costs
+    # one HMAC check per request. Each admission buys one booking.
+    admission_token = request.headers.get('Admission-Token')
+    if waiting_room is not None and not waiting_room.admit(admission_token):
+        return jsonify({"error": "Please wait for your turn", "waiting_room": "/waiting-room"}), 403
+    
     logger.info(f"Booking request received from {client_ip}")
     
     if not request.is_json:
         logger.warning(f"Non-JSON request from {client_ip}")
+        if waiting_room is not None:
+            waiting_room.refund(admission_token)
         return jsonify({"error": "Request must be JSON"}), 400
     
     data = request.get_json()
@@ -66,9 +271,21 @@ def book_with_logging():
     
     name = data.get('name')
     date = data.get('date')
+    # Optional: claim this exact seat instead of the first free one
+    row = data.get('row')
+    col = data.get('col')
+    # Optional: number of adjacent seats to hold together
+    quantity = data.get('quantity', 1)
+    # Optional: let the server pick the best-scoring seat or block
+    best = bool(data.get('best_available', False))
     
-    try:
-        result, status_code = handler.book(name, date)
+    # Set once this request holds seats or a waitlist place
+    held = []
+    
+    def book():
+        result, status_code = handler.book(name, date, row, col, quantity, best, client=client_ip)
+        if result.get('success') or result.get('waitlisted'):
+            held.append(True)
         
         if result.get('success'):
             logger.info(f"Booking successful for {client_ip}: {result['message']}")
@@ -78,29 +295,170 @@ def book_with_logging():
                 "event": "booking_update",
                 "timestamp": time.time(),
                 "client": client_ip,
-                "seat": result['seat']
+                "seat": result['seat'],
+                "seats": result['seats']
             })
+        elif result.get('waitlisted'):
+            logger.info(f"Sold out for {client_ip}, waitlist entry {result['waitlist']['waitlist_id']}")
         else:
-            logger.info(f"Booking failed for {client_ip}: {result['message']}")
+            logger.info(f"Booking failed for {client_ip}: {result.get('message', result.get('error'))}")
         
-        return jsonify(result), status_code
+        return result, status_code
+    
+    try:
+        return idempotent_response('booking', data, book)
         
     except Exception as e:
         logger.error(f"Error processing booking for {client_ip}: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        # A taken seat, a bad request or a replayed response held nothing
+        # new, so the admission still stands
+        if waiting_room is not None and not held:
+            waiting_room.refund(admission_token)
 
 def show_with_logging():
     client_ip = request.remote_addr
     logger.info(f"Show seats request from {client_ip}")
     
+    date = request.args.get('date')
+    since = request.args.get('since', type=int)
+    if date and not is_show_date(date):
+        return jsonify({"error": "Date must be given as YYYY-MM-DD"}), 400
+    
     try:
-        result = handler.show()
+        if since is not None:
+            # Delta mode: only the seats changed after the client's version
+            result = handler.show_since(since, date)
+            logger.info(f"Show seats since version {since} processed for {client_ip}")
+            response = jsonify(result)
+            response.headers['X-Seat-Version'] = str(result['version'])
+            return response
+        
+        version, result = handler.snapshot(date)
         logger.info(f"Show seats processed successfully for {client_ip}")
-        return jsonify(result)
+        response = jsonify(result)
+        response.headers['X-Seat-Version'] = str(version)
+        return response
     except Exception as e:
         logger.error(f"Error showing seats for {client_ip}: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
 
+def stats_with_logging():
+    client_ip = request.remote_addr
+    date = request.args.get('date')
+    logger.debug(f"Stats request from {client_ip}")
+    if date and not is_show_date(date):
+        return jsonify({"error": "Date must be given as YYYY-MM-DD"}), 400
+    
+    try:
+        # Counters are read without taking any seat lock
+        return jsonify(handler.stats(date))
+    except Exception as e:
+        logger.error(f"Error reading seat stats for {client_ip}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+def engine_stats_with_logging():
+    if engine is None:
+        return jsonify({"error": "The single-writer engine is not enabled"}), 404
+    # Queue depth shows directly how far the writer is behind
+    return jsonify(engine.queue_stats())
+
+def my_bookings_with_logging():
+    client_ip = request.remote_addr
+    name = request.args.get('name')
+    logger.debug(f"Bookings lookup from {client_ip}")
+    
+    if not name:
+        return jsonify({"error": "Missing name"}), 400
+    
+    try:
+        # Served from the per-customer index, not a scan of the seat map
+        return jsonify(handler.customer_bookings(name))
+    except Exception as e:
+        logger.error(f"Error looking up bookings for {client_ip}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+def waitlist_status_with_logging(waitlist_id):
+    client_ip = request.remote_addr
+    logger.debug(f"Waitlist status for {waitlist_id} from {client_ip}")
+    
+    try:
+        # Position while waiting; session and payment link once promoted
+        result, status_code = handler.waitlist_status(waitlist_id)
+        return jsonify(result), status_code
+    except Exception as e:
+        logger.error(f"Error reading waitlist entry for {client_ip}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+def leave_waitlist_with_logging(waitlist_id):
+    client_ip = request.remote_addr
+    logger.info(f"Leave waitlist request for {waitlist_id} from {client_ip}")
+    
+    try:
+        result, status_code = handler.leave_waitlist(waitlist_id)
+        return jsonify(result), status_code
+    except Exception as e:
+        logger.error(f"Error leaving waitlist for {client_ip}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+def enter_waiting_room():
+    client_ip = request.remote_addr
+    if waiting_room is None:
+        return jsonify({"error": "No waiting room is open"}), 404
+    
+    result = waiting_room.enter()
+    logger.info(f"Waiting room entered by {client_ip}, position {result.get('position', 0)}")
+    return jsonify(result)
+
+def waiting_room_status(queue_token):
+    if waiting_room is None:
+        return jsonify({"error": "No waiting room is open"}), 404
+    
+    # Position and ETA, or the admission token once it is this client's turn
+    result = waiting_room.status(queue_token)
+    if result is None:
+        return jsonify({"error": "Invalid or expired queue token"}), 404
+    response = jsonify(result)
+    if not result['admitted']:
+        response.headers['Retry-After'] = str(result['retry_after'])
+    return response
+
+def prices_with_logging():
+    client_ip = request.remote_addr
+    logger.debug(f"Price table request from {client_ip}")
+    
+    try:
+        return jsonify(handler.prices())
+    except Exception as e:
+        logger.error(f"Error reading prices for {client_ip}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+def set_prices_with_logging():
+    client_ip = request.remote_addr
+    logger.info(f"Price change request from {client_ip}")
+    
+    if not is_admin():
+        logger.warning(f"Unauthorised price change from {client_ip}")
+        return jsonify({"error": "Admin token required"}), 403
+    
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    
+    try:
+        # New holds are priced from the new table; existing ones keep their quote
+        result, status_code = handler.set_price_tiers(body.get('price_tiers', []))
+        if status_code == 200:
+            logger.info(f"Price table replaced by {client_ip}")
+        return jsonify(result), status_code
+    except Exception as e:
+        logger.error(f"Error changing prices for {client_ip}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
 def reset_with_logging():
     client_ip = request.remote_addr
     logger.info(f"Reset seats request from {client_ip}")
@@ -124,7 +482,16 @@ def reset_with_logging():
 # Register routes with logging wrappers
 app.add_url_rule('/booking', view_func=book_with_logging, methods=['POST'])
 app.add_url_rule('/booking/show', view_func=show_with_logging, methods=['GET'])
+app.add_url_rule('/booking/stats', view_func=stats_with_logging, methods=['GET'])
+app.add_url_rule('/booking/engine', view_func=engine_stats_with_logging, methods=['GET'])
+app.add_url_rule('/booking/mine', view_func=my_bookings_with_logging, methods=['GET'])
+app.add_url_rule('/booking/waitlist/<waitlist_id>', view_func=waitlist_status_with_logging, methods=['GET'])
+app.add_url_rule('/booking/waitlist/<waitlist_id>', view_func=leave_waitlist_with_logging, methods=['DELETE'])
 app.add_url_rule('/booking/reset', view_func=reset_with_logging, methods=['POST'])
+app.add_url_rule('/pricing', view_func=prices_with_logging, methods=['GET'])
+app.add_url_rule('/pricing', view_func=set_prices_with_logging, methods=['PUT'])
+app.add_url_rule('/waiting-room', view_func=enter_waiting_room, methods=['POST'])
+app.add_url_rule('/waiting-room/<queue_token>', view_func=waiting_room_status, methods=['GET'])
 
 # Payment routes
 @app.route('/payment/<session_id>')
@@ -133,6 +500,9 @@ def payment_page(session_id):
     client_ip = request.remote_addr
     logger.info(f"Payment page requested for session {session_id} by {client_ip}")
     
+    # Back (e.g. a reload) before the hold of a page just left was released
+    left_pages.pop(session_id, None)
+    
     session = payment_system.get_payment_session(session_id)
     if not session:
         return jsonify({"error": "Invalid session"}), 404
@@ -141,6 +511,13 @@ def payment_page(session_id):
     if session['status'] == 'expired':
         return jsonify({"error": "Payment session expired"}), 400
     
+    seat_info = session['seat_info']
+    if 'seats' in seat_info:
+        seat_label = (f"Row {seat_info['row'] + 1}, Columns {seat_info['seats'][0]['col'] + 1}"
+                      f"-{seat_info['seats'][-1]['col'] + 1} ({len(seat_info['seats'])} seats)")
+    else:
+        seat_label = f"Row {seat_info['row'] + 1}, Column {seat_info['col'] + 1}"
+    
     payment_html = f"""
     <!DOCTYPE html>
     <html lang="en">
@@ -253,7 +630,7 @@ def payment_page(session_id):
                 <h3>Booking Details</h3>
                 <p><strong>Name:</strong> {session['user_name']}</p>
                 <p><strong>Date:</strong> {session['date']}</p>
-                <p><strong>Seat:</strong> Row {session['seat_info']['row'] + 1}, Column {session['seat_info']['col'] + 1}</p>
+                <p><strong>Seat:</strong> {seat_label}</p>
             </div>
             
             <div class="amount">
@@ -282,7 +659,20 @@ def payment_page(session_id):
         
         <script>
             const sessionId = '{session_id}';
+            // Only the link handed to whoever placed the hold carries this
+            const cancelToken = new URLSearchParams(window.location.search).get('cancel');
             let selectedMethod = null;
+            // Set once the seats are paid for, so leaving no longer gives them back
+            let paid = false;
+            // One Idempotency-Key for paying this session, whichever method is
+            // picked, so a retry after a dropped response can never charge
+            // twice; replaced only once a payment has definitely failed
+            let paymentKey = newIdempotencyKey();
+            
+            function newIdempotencyKey() {{
+                const bytes = crypto.getRandomValues(new Uint8Array(16));
+                return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+            }}
             let timeLeft = 15 * 60; // 15 minutes in seconds
             
             // Timer countdown
@@ -327,7 +717,8 @@ def payment_page(session_id):
                     const response = await fetch(`/payment/${{sessionId}}/process`, {{
                         method: 'POST',
                         headers: {{
-                            'Content-Type': 'application/json'
+                            'Content-Type': 'application/json',
+                            'Idempotency-Key': paymentKey
                         }},
                         body: JSON.stringify({{
                             payment_method: selectedMethod
@@ -336,12 +727,16 @@ def payment_page(session_id):
                     
                     const result = await response.json();
                     
-                    if (result.success) {{
-                        showStatus('Payment successful! Redirecting to booking confirmation...', 'success');
+                    if (result.success || response.status === 409) {{
+                        // 409: an earlier attempt already paid for these seats
+                        paid = true;
+                        showStatus(result.success ? 'Payment successful! Redirecting to booking confirmation...'
+                                                  : result.message, 'success');
                         setTimeout(() => {{
                             window.location.href = '/';
                         }}, 2000);
                     }} else {{
+                        paymentKey = newIdempotencyKey();
                         showStatus(result.message || 'Payment failed', 'error');
                         button.disabled = false;
                         button.textContent = `Pay ${{document.getElementById('payAmount').textContent}}`;
@@ -360,6 +755,17 @@ def payment_page(session_id):
                 statusDiv.style.display = 'block';
             }}
             
+            // Backing out of the page hands the seats back shortly afterwards
+            // instead of holding them until the session runs out. The server
+            // waits a few seconds first, since a reload looks the same and
+            // loads the page straight back. A page kept in the back/forward
+            // cache may be shown again without loading, so it keeps its hold.
+            window.addEventListener('pagehide', event => {{
+                if (!paid && timeLeft > 0 && cancelToken && !event.persisted) {{
+                    navigator.sendBeacon(`/payment/${{sessionId}}/leave?cancel=${{encodeURIComponent(cancelToken)}}`);
+                }}
+            }});
+            
             // Start timer
             updateTimer();
         </script>
@@ -381,7 +787,7 @@ def process_payment(session_id):
     data = request.get_json()
     payment_method = data.get('payment_method', 'card')
     
-    try:
+    def pay():
         success, message = payment_system.process_payment(session_id, payment_method)
         
         if success:
@@ -396,29 +802,84 @@ def process_payment(session_id):
                     "event": "booking_update",
                     "timestamp": time.time(),
                     "client": client_ip,
-                    "seat": result['seat']
+                    "seat": result['seat'],
+                    "seats": result['seats']
                 })
                 
-                return jsonify({
+                return {
                     "success": True,
                     "message": "Payment successful and booking confirmed!",
                     "booking": result
-                }), 200
+                }, 200
             else:
-                return jsonify({
+                return {
                     "success": False,
                     "message": "Payment successful but booking confirmation failed"
-                }), 500
+                }, 500
+        elif payment_system.check_payment_status(session_id)[0]:
+            return {
+                "success": False,
+                "message": "These seats are already paid for"
+            }, 409
         else:
-            return jsonify({
+            return {
                 "success": False,
                 "message": message
-            }), 400
+            }, 400
+    
+    try:
+        # The key stands for paying this session, so a retry that switched
+        # payment method replays the first payment instead of failing
+        return idempotent_response(f'payment:{session_id}', {"session_id": session_id}, pay)
             
     except Exception as e:
         logger.error(f"Error processing payment for session {session_id}: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
 
+def cancel_and_announce(session_id, cancel_token):
+    """Cancel an unpaid hold and tell every seat map about the freed seats"""
+    result, status_code = handler.cancel_hold(session_id, cancel_token)
+    if result.get('success') and result['seats']:
+        booking_events.put({
+            "event": "seats_released",
+            "timestamp": time.time(),
+            "date": result['date'],
+            "seats": result['seats']
+        })
+    return result, status_code
+
+def cancel_hold(session_id):
+    """Give an unpaid hold's seats back to the pool right away"""
+    client_ip = request.remote_addr
+    logger.info(f"Hold cancellation requested for session {session_id} by {client_ip}")
+    
+    try:
+        # The token from the hold's payment link; the session id is public
+        result, status_code = cancel_and_announce(session_id, request.args.get('cancel'))
+        return jsonify(result), status_code
+    except Exception as e:
+        logger.error(f"Error cancelling hold for session {session_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+def leave_payment_page(session_id):
+    """Cancel a hold shortly after its payment page was closed, unless it is reopened"""
+    client_ip = request.remote_addr
+    cancel_token = request.args.get('cancel')
+    if not payment_system.check_cancel_token(session_id, cancel_token):
+        return jsonify({"success": False, "message": "Invalid cancel token"}), 403
+    
+    logger.info(f"Payment page for session {session_id} left by {client_ip}")
+    deadline = time.time() + LEAVE_GRACE_SECONDS
+    left_pages[session_id] = (cancel_token, deadline)
+    abandoned_holds.schedule(session_id, datetime.fromtimestamp(deadline))
+    return jsonify({"success": True, "message": f"Hold will be released in {LEAVE_GRACE_SECONDS} seconds"}), 202
+
+# navigator.sendBeacon can only POST, so there is a POST route for cancelling too
+app.add_url_rule('/payment/<session_id>', view_func=cancel_hold, methods=['DELETE'])
+app.add_url_rule('/payment/<session_id>/cancel', endpoint='cancel_hold_beacon', view_func=cancel_hold,
+                 methods=['POST'])
+app.add_url_rule('/payment/<session_id>/leave', view_func=leave_payment_page, methods=['POST'])
+
 @app.route('/payment/<session_id>/status')
 def payment_status(session_id):
     """Check payment status for a session"""
@@ -470,7 +931,7 @@ if __name__ == '__main__':
     logger.info("Starting Flask application...")
     logger.info(f"Debug mode: {True}")
     logger.info(f"Log file: app.log")
-    logger.info(f"Seat matrix dimensions: 10 rows x 5 columns (50 total seats)")
+    logger.info(f"Seat matrix dimensions per show date: {handler.rows} rows x {handler.cols} columns ({handler.capacity} total seats)")
     
     try:
         app.run(debug=True, port=5001)
@@ -0,0 +1,73 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from seat import TicketBooking
+from storage import STORAGE_BACKENDS, inventory_factory
+
+DATE = "2025-08-06"
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_backend(backend, rows, cols, section_rows, num_threads, workdir):
+    """
+    Sells out one show date with num_threads threads reserving single seats
+    and returns (reservations, seconds, per-request latencies).
+    """
+    location = os.path.join(workdir, "seats.db" if backend == "sqlite" else backend)
+    booking = TicketBooking(rows=rows, cols=cols, section_rows=section_rows,
+                            inventory_factory=inventory_factory(backend, location))
+    booking.get_available_count(DATE)  # create the inventory outside the timing
+
+    latencies = [[] for _ in range(num_threads)]
+    reserved = [0] * num_threads
+    start_barrier = threading.Barrier(num_threads + 1)
+
+    def reserve_until_sold_out(thread_id):
+        start_barrier.wait()
+        while True:
+            started = time.perf_counter()
+            result, _ = booking.reserve_seat(f"Thread-{thread_id}", DATE)
+            latencies[thread_id].append(time.perf_counter() - started)
+            if not result.get("success"):
+                return
+            reserved[thread_id] += 1
+
+    threads = [threading.Thread(target=reserve_until_sold_out, args=(i,)) for i in range(num_threads)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    start_time = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start_time
+
+    if booking.get_booked_count(DATE) != sum(reserved):
+        raise RuntimeError(f"{backend}: {sum(reserved)} reservations but {booking.get_booked_count(DATE)} booked seats")
+    return sum(reserved), elapsed, [latency for thread_latencies in latencies for latency in thread_latencies]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare reservation throughput and latency per storage backend")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--cols", type=int, default=50)
+    parser.add_argument("--section-rows", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--backends", nargs="+", choices=STORAGE_BACKENDS, default=list(STORAGE_BACKENDS))
+    args = parser.parse_args()
+
+    print(f"Selling {args.rows}x{args.cols} seats with {args.threads} threads\n")
+    print(f"{'backend':<8} {'seats':>7} {'seconds':>8} {'per sec':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in args.backends:
+            count, elapsed, latencies = run_backend(
+                backend, args.rows, args.cols, args.section_rows, args.threads, workdir
+            )
+            print(f"{backend:<8} {count:>7} {elapsed:>8.2f} {count / elapsed:>9.0f} "
+                  f"{percentile(latencies, 0.50) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
@@ -0,0 +1,152 @@
+import threading
+
+
+class CustomerIndex:
+    """Every customer's holds and bookings, kept in step with seat transitions
+
+    Entries are keyed by payment session, so "my bookings" is a dict
+    lookup and each transition touches one entry. ``max_holds`` caps the
+    seats one customer may hold unpaid at a time; slots are taken before
+    a reservation starts so concurrent requests from the same customer
+    can't overshoot it. The same cap applies per client address, since a
+    name is whatever the request says it is.
+    """
+
+    def __init__(self, max_holds=None):
+        self.max_holds = max_holds
+        self.sessions = {}  # customer -> {session_id: booking}
+        self.owners = {}  # session_id -> customer
+        self.clients = {}  # session_id -> client address the hold was made from
+        self.holds = {}  # customer -> unpaid seats, including reservations in flight
+        self.client_holds = {}  # client address -> unpaid seats, likewise
+        self.lock = threading.Lock()
+
+    def acquire_holds(self, customer, count, client=None):
+        """Take ``count`` hold slots for a reservation; False if over quota"""
+        with self.lock:
+            held = self.holds.get(customer, 0)
+            client_held = self.client_holds.get(client, 0)
+            if self.max_holds is not None and max(held, client_held) + count > self.max_holds:
+                return False
+            self.holds[customer] = held + count
+            if client is not None:
+                self.client_holds[client] = client_held + count
+            return True
+
+    def release_holds(self, customer, count, client=None):
+        """Give back hold slots of a reservation that failed or ended"""
+        with self.lock:
+            self._release_holds(customer, count, client)
+
+    def _release_holds(self, customer, count, client=None):
+        for holds, key in ((self.holds, customer), (self.client_holds, client)):
+            if key is None:
+                continue
+            held = holds.get(key, 0) - count
+            if held > 0:
+                holds[key] = held
+            else:
+                holds.pop(key, None)
+
+    def add(self, customer, session_id, date, seats, status="reserved", client=None):
+        """Record a new hold whose slots were taken with ``acquire_holds``"""
+        with self.lock:
+            self.owners[session_id] = customer
+            if client is not None:
+                self.clients[session_id] = client
+            self.sessions.setdefault(customer, {})[session_id] = {
+                "session_id": session_id,
+                "date": date,
+                "seats": [(seat["row"], seat["col"]) for seat in seats],
+                "status": status
+            }
+
+    def restore(self, bookings):
+        """Replace the index with recovered ``(customer, session_id, date, seats, status)`` bookings
+
+        ``seats`` are ``(row, col)`` pairs. Unpaid ones take hold slots;
+        client addresses aren't recovered, so only the per-name cap applies
+        to them.
+        """
+        sessions, owners, holds = {}, {}, {}
+        for customer, session_id, date, seats, status in bookings:
+            owners[session_id] = customer
+            sessions.setdefault(customer, {})[session_id] = {
+                "session_id": session_id,
+                "date": date,
+                "seats": list(seats),
+                "status": status
+            }
+            if status == "reserved":
+                holds[customer] = holds.get(customer, 0) + len(seats)
+        with self.lock:
+            self.sessions, self.owners, self.clients = sessions, owners, {}
+            self.holds, self.client_holds = holds, {}
+
+    def confirm(self, session_id):
+        """A hold was paid for; its seats stop counting against the quota"""
+        with self.lock:
+            booking = self._booking(session_id)
+            if booking is not None and booking["status"] == "reserved":
+                booking["status"] = "confirmed"
+                self._release_holds(self.owners[session_id], len(booking["seats"]),
+                                    self.clients.get(session_id))
+
+    def drop_seat(self, session_id, row, col):
+        """One seat of a session was released"""
+        with self.lock:
+            booking = self._booking(session_id)
+            if booking is None or (row, col) not in booking["seats"]:
+                return
+            booking["seats"].remove((row, col))
+            if booking["status"] == "reserved":
+                self._release_holds(self.owners[session_id], 1, self.clients.get(session_id))
+            if not booking["seats"]:
+                self._forget(session_id)
+
+    def drop_session(self, session_id):
+        """Every seat of a session was released or expired"""
+        with self.lock:
+            booking = self._booking(session_id)
+            if booking is None:
+                return
+            if booking["status"] == "reserved":
+                self._release_holds(self.owners[session_id], len(booking["seats"]),
+                                    self.clients.get(session_id))
+            self._forget(session_id)
+
+    def clear(self):
+        """Forget every booking (after a reset); in-flight hold slots stay taken"""
+        with self.lock:
+            for customer, bookings in self.sessions.items():
+                for session_id, booking in bookings.items():
+                    if booking["status"] == "reserved":
+                        self._release_holds(customer, len(booking["seats"]), self.clients.get(session_id))
+            self.sessions = {}
+            self.owners = {}
+            self.clients = {}
+
+    def bookings(self, customer):
+        """Copies of a customer's current holds and bookings"""
+        with self.lock:
+            return [
+                dict(booking, seats=[{"row": r, "col": c} for r, c in booking["seats"]])
+                for booking in self.sessions.get(customer, {}).values()
+            ]
+
+    def held(self, customer):
+        return self.holds.get(customer, 0)
+
+    def _booking(self, session_id):
+        customer = self.owners.get(session_id)
+        if customer is None:
+            return None
+        return self.sessions[customer].get(session_id)
+
+    def _forget(self, session_id):
+        customer = self.owners.pop(session_id)
+        self.clients.pop(session_id, None)
+        bookings = self.sessions[customer]
+        del bookings[session_id]
+        if not bookings:
+            del self.sessions[customer]
@@ -0,0 +1,128 @@
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+
+class BookingEngine:
+    """Applies every booking write on one thread, a batch at a time
+
+    Reserve, confirm, release, expiry and reset calls are queued as
+    commands and run in arrival order by a single writer thread, so
+    request threads never contend for seat locks; they just wait on their
+    command's future. The writer takes every command already queued (up
+    to ``batch_size``) as one batch, applies them back to back and waits
+    for the journal once for the whole batch before answering any of
+    them. Reads don't queue: they go straight to the wrapped
+    ``TicketBooking``, whose seat maps are published as snapshots.
+    """
+
+    def __init__(self, booking, batch_size=256):
+        self.booking = booking
+        self.batch_size = batch_size
+        self.commands = queue.Queue()  # (future, method, args, kwargs)
+        self.batches = 0
+        self.applied = 0
+        self.largest_batch = 0
+        self.thread = None
+
+    def __getattr__(self, name):
+        # Anything not queued below is a read or setup call
+        return getattr(self.booking, name)
+
+    def submit(self, method, *args, **kwargs):
+        """Queue ``method(*args, **kwargs)`` for the writer and return its future"""
+        future = Future()
+        self.commands.put((future, method, args, kwargs))
+        return future
+
+    def _call(self, method, *args, **kwargs):
+        if threading.current_thread() is self.thread or self.thread is None:
+            # From the writer itself (a callback), or before start()
+            return method(*args, **kwargs)
+        return self.submit(method, *args, **kwargs).result()
+
+    def reserve_seat(self, *args, **kwargs):
+        return self._call(self.booking.reserve_seat, *args, **kwargs)
+
+    def book(self, *args, **kwargs):
+        return self._call(self.booking.book, *args, **kwargs)
+
+    def confirm_booking(self, session_id):
+        return self._call(self.booking.confirm_booking, session_id)
+
+    def release_seat(self, date, row, col):
+        return self._call(self.booking.release_seat, date, row, col)
+
+    def release_session(self, session_id):
+        return self._call(self.booking.release_session, session_id)
+
+    def cancel_hold(self, session_id, cancel_token):
+        return self._call(self.booking.cancel_hold, session_id, cancel_token)
+
+    def expire_holds(self, session_ids):
+        return self._call(self.booking.expire_holds, session_ids)
+
+    def leave_waitlist(self, waitlist_id):
+        return self._call(self.booking.leave_waitlist, waitlist_id)
+
+    def reset(self):
+        return self._call(self.booking.reset)
+
+    def queue_stats(self):
+        """Commands waiting right now, and totals since start"""
+        return {
+            "queue_depth": self.commands.qsize(),
+            "batches": self.batches,
+            "commands": self.applied,
+            "largest_batch": self.largest_batch
+        }
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name="booking-engine", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.commands.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _take(self):
+        """Block for one command, then take whatever else is already queued"""
+        batch = [self.commands.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.commands.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            stopping = None in batch
+            batch = [command for command in batch if command is not None]
+            outcomes = []
+            journal = self.booking.journal
+            with journal.deferred_sync() if journal is not None else nullcontext():
+                for future, method, args, kwargs in batch:
+                    try:
+                        outcomes.append((future, True, method(*args, **kwargs)))
+                    except Exception as e:
+                        # Raised again in the request thread waiting on it
+                        outcomes.append((future, False, e))
+            # Answered only once the whole batch is durable
+            for future, ok, value in outcomes:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            self.batches += 1
+            self.applied += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            if stopping:
+                return
@@ -0,0 +1,40 @@
+import queue
+import threading
+
+
+class EventBroadcaster:
+    """Delivers every booking event to each connected SSE client
+
+    Each stream subscribes its own queue and ``put`` copies the event into
+    all of them, so no client takes an event meant for the others. A
+    client more than ``backlog`` events behind is cut off; its stream
+    ends and the browser reconnects and reloads the seat map.
+    """
+
+    def __init__(self, backlog=1000):
+        self.backlog = backlog
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        """A new queue that receives every event put from now on"""
+        events = queue.Queue(self.backlog)
+        with self.lock:
+            self.subscribers.add(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            self.subscribers.discard(events)
+
+    def subscribed(self, events):
+        return events in self.subscribers
+
+    def put(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                self.unsubscribe(events)
@@ -0,0 +1,74 @@
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class HoldExpiryScheduler:
+    """Releases unpaid holds once their payment session runs out
+
+    Deadlines sit in a min-heap served by one background thread. Each wake-up
+    pops only the holds that are due and hands them to ``on_expired`` as one
+    batch, so the cost is O(expired log n) rather than a scan of every seat.
+    Holds that were paid for or released in the meantime are simply ignored
+    by ``on_expired`` when their deadline comes up.
+    """
+
+    def __init__(self, on_expired, batch_size=500):
+        self.on_expired = on_expired
+        self.batch_size = batch_size
+        self.deadlines = []  # (expires_at timestamp, session_id)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def schedule(self, session_id, expires_at):
+        """Release ``session_id`` at ``expires_at`` (a datetime) unless paid"""
+        with self.condition:
+            heapq.heappush(self.deadlines, (expires_at.timestamp(), session_id))
+            # Only an earlier deadline changes how long the worker should sleep
+            if self.deadlines[0][1] == session_id:
+                self.condition.notify()
+
+    def pending(self):
+        return len(self.deadlines)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="hold-expiry", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+
+    def _due(self):
+        """Wait for the next batch of expired holds; None once stopped"""
+        with self.condition:
+            while self.running:
+                now = time.time()
+                if self.deadlines and self.deadlines[0][0] <= now:
+                    due = []
+                    while self.deadlines and self.deadlines[0][0] <= now and len(due) < self.batch_size:
+                        due.append(heapq.heappop(self.deadlines)[1])
+                    return due
+                timeout = self.deadlines[0][0] - now if self.deadlines else None
+                self.condition.wait(timeout)
+            return None
+
+    def _run(self):
+        while True:
+            due = self._due()
+            if due is None:
+                return
+            try:
+                self.on_expired(due)
+            except Exception as e:
+                logger.error(f"Error releasing {len(due)} expired holds: {str(e)}", exc_info=True)
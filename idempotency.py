@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdempotencyCache:
+    """Remembers responses by Idempotency-Key so retries don't repeat work
+
+    Holds at most ``max_entries`` responses, each for ``ttl`` seconds;
+    the oldest entry is evicted first once the cache is full. A request
+    arriving while the first one with the same key is still running
+    waits for its result instead of running again. Server errors are not
+    stored, so a retry after one gets a fresh attempt.
+    """
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, fingerprint, body, status)
+        self.in_flight = {}  # key -> Event set once the first request finishes
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(payload):
+        return json.dumps(payload, sort_keys=True, default=str)
+
+    def _lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self.entries[key]
+            return None
+        return entry
+
+    def _evict(self, now):
+        # Entries are kept in insertion order, which is also expiry order
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry[0] > now and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+
+    def run(self, key, payload, handle):
+        """Return ``(body, status, replayed)`` for ``key``
+
+        The first request with a key runs ``handle()``, which returns
+        ``(body, status)``; later ones get the stored response back with
+        ``replayed`` set. Reusing a key for a different ``payload`` is a
+        client error and answered with 422.
+        """
+        fingerprint = self.fingerprint(payload)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                entry = self._lookup(key, now)
+                if entry is not None:
+                    _, stored_fingerprint, body, status = entry
+                    if stored_fingerprint != fingerprint:
+                        return {"error": "Idempotency-Key was already used for a different request"}, 422, False
+                    return body, status, True
+                pending = self.in_flight.get(key)
+                if pending is None:
+                    pending = self.in_flight[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            body, status = handle()
+        except BaseException:
+            with self.lock:
+                del self.in_flight[key]
+            pending.set()
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            if status < 500:
+                now = time.monotonic()
+                self.entries[key] = (now + self.ttl, fingerprint, body, status)
+                self._evict(now)
+        pending.set()
+        return body, status, False
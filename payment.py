@@ -1,6 +1,11 @@
+import hashlib
+import hmac
+import os
 import uuid
 import time
+import threading
 from datetime import datetime, timedelta
+from pricing import DEFAULT_PRICE, DEFAULT_TIER
 
 class Payment:
     def __init__(self):
@@ -8,52 +13,105 @@ class Payment:
         self.pending_payments = {}
         self.completed_payments = {}
         self.payment_sessions = {}
+        # Guards status changes so a payment and an expiry can't both win
+        self.lock = threading.Lock()
+        # Optional WriteAheadLog recording every session transition
+        self.journal = None
+        # Reset generation stamped on every session; sessions from an
+        # older one are treated as gone until the sweep removes them
+        self.epoch = 0
+        # Seats sold and takings per price tier, from completed payments
+        self.revenue = {}  # tier -> {"seats": n, "amount": total}
+        # Signs cancel tokens; worker processes must share it to accept
+        # each other's
+        self.secret = os.urandom(32)
+    
+    def _log(self, op, **fields):
+        if self.journal is not None:
+            self.journal.append(op, **fields)
         
-    def create_payment_session(self, seat_info, user_name, date):
-        """Create a new payment session for a seat booking"""
+    def _count_sale(self, session):
+        """Add a completed session's seats to the tier revenue (caller holds the lock)"""
+        for tier, price in session['seat_prices']:
+            sold = self.revenue.setdefault(tier, {"seats": 0, "amount": 0.0})
+            sold["seats"] += 1
+            sold["amount"] += price
+    
+    def create_payment_session(self, seat_info, user_name, date, quantity=1, seat_prices=None):
+        """Create a new payment session for one or more seats booked together
+
+        ``seat_prices`` holds a ``[tier, price]`` pair per seat; without it
+        every seat is a standard one at the default price.
+        """
         session_id = str(uuid.uuid4())
+        if seat_prices is None:
+            seat_prices = [[DEFAULT_TIER, DEFAULT_PRICE]] * quantity
         payment_data = {
             'session_id': session_id,
             'seat_info': seat_info,
             'user_name': user_name,
             'date': date,
-            'amount': 25.00,  # Fixed ticket price
+            'quantity': quantity,
+            'amount': sum(price for _, price in seat_prices),
+            'seat_prices': seat_prices,
             'created_at': datetime.now(),
             'expires_at': datetime.now() + timedelta(minutes=15),  # 15 minute expiry
-            'status': 'pending'
+            'status': 'pending',
+            'epoch': self.epoch
         }
         
         self.payment_sessions[session_id] = payment_data
+        self._log('payment_created', session_id=session_id, seat_info=seat_info, user_name=user_name,
+                  date=date, quantity=quantity, amount=payment_data['amount'],
+                  created_at=payment_data['created_at'].timestamp(),
+                  expires_at=payment_data['expires_at'].timestamp(), epoch=payment_data['epoch'],
+                  seat_prices=seat_prices)
         return session_id, payment_data
     
     def get_payment_session(self, session_id):
-        """Get payment session by ID"""
-        return self.payment_sessions.get(session_id)
+        """Get payment session by ID; sessions from before a reset are gone"""
+        session = self.payment_sessions.get(session_id)
+        if session is None or session.get('epoch', 0) != self.epoch:
+            return None
+        return session
     
     def process_payment(self, session_id, payment_method="card"):
         """Process payment for a session"""
-        if session_id not in self.payment_sessions:
-            return False, "Invalid session ID"
-        
-        session = self.payment_sessions[session_id]
-        
-        # Check if session has expired
-        if datetime.now() > session['expires_at']:
-            return False, "Payment session expired"
-        
-        # Simulate payment processing
-        if payment_method in ["card", "paypal", "wallet"]:
-            # Mark payment as completed
-            session['status'] = 'completed'
-            session['payment_method'] = payment_method
-            session['completed_at'] = datetime.now()
+        with self.lock:
+            # Looked up under the lock, so a session cancelled or wiped by a
+            # reset a moment ago can't be paid for
+            session = self.get_payment_session(session_id)
+            if session is None:
+                return False, "Invalid session ID"
             
-            # Move to completed payments
-            self.completed_payments[session_id] = session
+            # A second payment for the same seats (e.g. another method
+            # tried while the first response was slow) is refused
+            if session['status'] == 'completed':
+                return False, "Payment already completed"
             
-            return True, "Payment successful"
-        else:
-            return False, "Invalid payment method"
+            # Check if session has expired
+            if session['status'] == 'expired' or datetime.now() > session['expires_at']:
+                return False, "Payment session expired"
+            
+            # Simulate payment processing
+            if payment_method in ["card", "paypal", "wallet"]:
+                # Mark payment as completed
+                session['status'] = 'completed'
+                session['payment_method'] = payment_method
+                session['completed_at'] = datetime.now()
+                
+                # Move to completed payments
+                self.completed_payments[session_id] = session
+                self._count_sale(session)
+                self._log('payment_completed', session_id=session_id, payment_method=payment_method,
+                          completed_at=session['completed_at'].timestamp())
+            else:
+                return False, "Invalid payment method"
+        
+        # Only report success once the payment is on disk
+        if self.journal is not None:
+            self.journal.sync()
+        return True, "Payment successful"
     
     def check_payment_status(self, session_id):
         """Check if payment is completed for a session"""
@@ -68,12 +126,65 @@ class Payment:
         else:
             return False, None
     
+    def cancel_token(self, session_id):
+        """Proof that a caller placed the hold, returned only to the booking client
+
+        Session ids appear in every public seat map, so knowing one proves
+        nothing. The token is an HMAC of the id, so nothing is stored.
+        """
+        return hmac.new(self.secret, session_id.encode(), hashlib.sha256).hexdigest()[:32]
+    
+    def check_cancel_token(self, session_id, token):
+        return hmac.compare_digest(self.cancel_token(session_id).encode(), (token or "").encode())
+    
     def cancel_payment_session(self, session_id):
-        """Cancel a payment session"""
-        if session_id in self.payment_sessions:
+        """Cancel an unpaid payment session; False if it was paid, expired or is unknown"""
+        with self.lock:
+            session = self.get_payment_session(session_id)
+            if not session or session['status'] != 'pending':
+                return False
+            # Anyone still holding the dict sees it is no longer payable
+            session['status'] = 'cancelled'
             del self.payment_sessions[session_id]
+            self._log('payment_removed', session_id=session_id)
             return True
-        return False
+    
+    def expire_session(self, session_id):
+        """Mark an unpaid session as expired; False if it was paid or is unknown"""
+        with self.lock:
+            session = self.get_payment_session(session_id)
+            if not session or session['status'] != 'pending':
+                return False
+            session['status'] = 'expired'
+            self._log('payment_expired', session_id=session_id)
+            return True
+    
+    def revenue_by_tier(self):
+        """Seats sold and takings per price tier"""
+        with self.lock:
+            return {tier: dict(sold) for tier, sold in self.revenue.items()}
+    
+    def reset(self):
+        """Invalidate every session at once
+
+        Only bumps the epoch, so older sessions disappear for lookups
+        straight away; a background thread then sweeps them out of
+        ``payment_sessions``. Unpaid ones are dropped, completed ones stay
+        in ``completed_payments`` as the archive.
+        """
+        with self.lock:
+            self.epoch += 1
+            epoch = self.epoch
+            self._log('payment_reset', epoch=epoch)
+        threading.Thread(target=self._sweep, args=(epoch,), name="payment-sweep", daemon=True).start()
+        if self.journal is not None:
+            self.journal.sync()
+    
+    def _sweep(self, epoch):
+        """Remove sessions from before ``epoch`` from the live table"""
+        for session_id, session in list(self.payment_sessions.items()):
+            if session.get('epoch', 0) < epoch:
+                self.payment_sessions.pop(session_id, None)
     
     def cleanup_expired_sessions(self):
         """Remove expired payment sessions"""
@@ -86,8 +197,93 @@ class Payment:
         
         for session_id in expired_sessions:
             del self.payment_sessions[session_id]
+            self._log('payment_removed', session_id=session_id)
         
         return len(expired_sessions)
+    
+    def capture(self):
+        """Copy the reset epoch and every session for a snapshot
+
+        Completed payments whose session was already cleaned up are kept
+        too, flagged ``archived``, since bookings are confirmed from them.
+        """
+        with self.lock:
+            sessions = [
+                dict(session) for session in list(self.payment_sessions.values())
+                if session.get('epoch', 0) == self.epoch
+            ]
+            live = {session['session_id'] for session in sessions}
+            archived = [
+                dict(session, archived=True) for session_id, session in list(self.completed_payments.items())
+                if session_id not in live
+            ]
+            epoch = self.epoch
+        return epoch, sessions + archived
+    
+    def load(self, sessions, epoch=0):
+        """Restore the epoch and sessions from ``capture()`` output"""
+        with self.lock:
+            self.payment_sessions = {
+                session['session_id']: session for session in sessions if not session.pop('archived', False)
+            }
+            self.completed_payments = {
+                session['session_id']: session for session in sessions if session['status'] == 'completed'
+            }
+            self.epoch = max(epoch, max((session.get('epoch', 0) for session in sessions), default=0))
+            self.revenue = {}
+            for session in self.completed_payments.values():
+                self._count_sale(session)
+    
+    def recovered_sessions(self):
+        """Every current and archived session, once each, for rebuilding indexes"""
+        sessions = dict(self.completed_payments)
+        sessions.update(self.payment_sessions)
+        return list(sessions.values())
+    
+    def apply(self, record):
+        """Redo one journalled session transition during recovery"""
+        op = record['op']
+        if op == 'payment_reset':
+            self.epoch = max(self.epoch, record['epoch'])
+            self._sweep(record['epoch'])
+            return
+        
+        session_id = record['session_id']
+        if op == 'payment_created':
+            # Already restored from the snapshot, maybe paid since; a fresh
+            # pending copy would get its sale counted a second time
+            if session_id in self.payment_sessions or session_id in self.completed_payments:
+                return
+            self.payment_sessions[session_id] = {
+                'session_id': session_id,
+                'seat_info': record['seat_info'],
+                'user_name': record['user_name'],
+                'date': record['date'],
+                'quantity': record['quantity'],
+                'amount': record['amount'],
+                'seat_prices': record.get('seat_prices', [[DEFAULT_TIER, DEFAULT_PRICE]] * record['quantity']),
+                'created_at': datetime.fromtimestamp(record['created_at']),
+                'expires_at': datetime.fromtimestamp(record['expires_at']),
+                'status': 'pending',
+                'epoch': record.get('epoch', 0)
+            }
+            return
+        
+        session = self.payment_sessions.get(session_id)
+        if session is None:
+            return
+        if op == 'payment_completed':
+            # Replays on top of a snapshot may find the payment already counted
+            if session['status'] != 'completed':
+                self._count_sale(session)
+            session['status'] = 'completed'
+            session['payment_method'] = record['payment_method']
+            session['completed_at'] = datetime.fromtimestamp(record['completed_at'])
+            self.completed_payments[session_id] = session
+        elif op == 'payment_expired':
+            session['status'] = 'expired'
+        elif op == 'payment_removed':
+            del self.payment_sessions[session_id]
 
 # Global payment instance
 payment_system = Payment()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import json
+import math
+from array import array
+
+# Price of a seat no tier covers, and of every seat without a price table
+DEFAULT_PRICE = 25.00
+DEFAULT_TIER = "standard"
+
+
+class PriceTable:
+    """Ticket prices by tier, with every seat's tier worked out up front
+
+    ``tiers`` lists ``(name, price)`` pairs and ``row_tiers`` the tier
+    index of each row. The per-row indexes are expanded into one byte per
+    seat, keyed by the row-major seat id, so pricing a seat is a single
+    array lookup. A table is never changed once built; new prices mean a
+    new table.
+    """
+
+    def __init__(self, rows, cols, tiers, row_tiers):
+        if len(tiers) > 256:
+            raise ValueError("At most 256 price tiers are supported")
+        if len(row_tiers) != rows:
+            raise ValueError(f"Expected a tier for each of {rows} rows, got {len(row_tiers)}")
+        self.rows = rows
+        self.cols = cols
+        self.names = tuple(name for name, _ in tiers)
+        self.prices = array('d', (float(price) for _, price in tiers))
+        self.seat_tiers = bytes(tier for tier in row_tiers for _ in range(cols))
+
+    @classmethod
+    def uniform(cls, rows, cols, price=DEFAULT_PRICE):
+        """Every seat in one tier at ``price``"""
+        return cls(rows, cols, [(DEFAULT_TIER, price)], [0] * rows)
+
+    @classmethod
+    def from_config(cls, rows, cols, config):
+        """Build a table from a list of tier dicts
+
+        Each tier has a unique ``name``, a finite positive ``price`` and
+        the inclusive ``rows`` range ``[first, last]`` it covers; later
+        tiers win where ranges overlap. Rows no tier covers are sold as
+        ``"standard"`` at ``DEFAULT_PRICE``.
+        """
+        tiers = [(DEFAULT_TIER, DEFAULT_PRICE)]
+        row_tiers = [0] * rows
+        names = set()
+        for tier in config:
+            if tier["name"] in names:
+                raise ValueError(f"Price tier {tier['name']} is listed twice")
+            names.add(tier["name"])
+            if isinstance(tier["price"], bool):
+                raise TypeError(f"Price tier {tier['name']} has a price that isn't a number")
+            price = float(tier["price"])
+            # float() also parses "nan" and "inf"
+            if not math.isfinite(price) or price <= 0:
+                raise ValueError(f"Price tier {tier['name']} needs a finite price above zero")
+            first, last = tier["rows"]
+            if not 0 <= first <= last < rows:
+                raise ValueError(f"Price tier {tier['name']} covers rows outside the venue")
+            if tier["name"] == DEFAULT_TIER:
+                tiers[0] = (DEFAULT_TIER, price)
+                index = 0
+            else:
+                index = len(tiers)
+                tiers.append((tier["name"], price))
+            row_tiers[first:last + 1] = [index] * (last - first + 1)
+        return cls(rows, cols, tiers, row_tiers)
+
+    def seat_prices(self, positions):
+        """``[tier name, price]`` for each ``(row, col)`` in ``positions``"""
+        return [
+            [self.names[tier], self.prices[tier]]
+            for tier in (self.seat_tiers[row * self.cols + col] for row, col in positions)
+        ]
+
+    def as_dict(self):
+        """The tiers with the ``[first, last]`` row ranges each one covers"""
+        tiers = [{"name": name, "price": price, "rows": []} for name, price in zip(self.names, self.prices)]
+        for row in range(self.rows):
+            ranges = tiers[self.seat_tiers[row * self.cols]]["rows"]
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        return {"tiers": tiers}
+
+
+class Pricing:
+    """The price table currently in force for a venue
+
+    Readers take ``table`` once per reservation and price every seat from
+    that object, so ``swap`` (a single attribute assignment) switches
+    prices atomically without readers ever taking a lock. Holds already
+    placed keep the prices they were quoted.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def swap(self, table):
+        current = self.table
+        if (table.rows, table.cols) != (current.rows, current.cols):
+            raise ValueError(f"Price table is for a {table.rows}x{table.cols} venue, "
+                             f"not {current.rows}x{current.cols}")
+        self.table = table
+
+    def seat_prices(self, positions):
+        return self.table.seat_prices(positions)
+
+
+def load_price_tiers(path):
+    """Price tiers from the ``price_tiers`` list of a venue layout file, or None"""
+    with open(path) as f:
+        return json.load(f).get("price_tiers")
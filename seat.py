@@ -1,112 +1,1679 @@
+import gc
+import os
 import threading
 import json
+import heapq
+from collections import Counter, deque
+from array import array
+from contextlib import contextmanager, ExitStack
+from itertools import compress
+from datetime import date as calendar_date, datetime
 from payment import payment_system
+from snapshot import read_snapshot
+from customers import CustomerIndex
+from waitlist import Waitlist
+from pricing import PriceTable, Pricing, load_price_tiers
+
+# Seat status codes stored in each section's status column
+FREE, HELD, RESERVED, CONFIRMED = range(4)
+STATUS_NAMES = (None, "held", "reserved", "confirmed")
+
+# Payment method codes stored in each section's method column
+PAYMENT_METHODS = (None, "card", "paypal", "wallet", "unknown")
+PAYMENT_METHOD_CODES = {method: code for code, method in enumerate(PAYMENT_METHODS)}
+
+DEFAULT_ROWS = 10
+DEFAULT_COLS = 5
+DEFAULT_SECTION_ROWS = 2
+
+# Seat changes remembered per inventory for /booking/show?since=
+CHANGE_LOG_SIZE = 1024
+
+
+def load_venue_layout(path):
+    """Read venue dimensions from a JSON layout file
+
+    The file holds ``rows`` and ``cols`` and optionally ``section_rows``.
+    """
+    with open(path) as f:
+        layout = json.load(f)
+    return (
+        int(layout["rows"]),
+        int(layout["cols"]),
+        int(layout.get("section_rows", DEFAULT_SECTION_ROWS)),
+    )
+
+
+def is_show_date(value):
+    """Whether ``value`` is a show date written as ``YYYY-MM-DD``"""
+    # Only the canonical spelling, so one date never gets two inventories
+    try:
+        return calendar_date.fromisoformat(value).isoformat() == value
+    except (TypeError, ValueError):
+        return False
+
+
+@contextmanager
+def gc_paused():
+    """Suspend automatic garbage collection for the duration of the block"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class StringTable:
+    """Reference-counted interned strings; id 0 stands for None"""
 
-class TicketBooking:
     def __init__(self):
-        # Use consistent dimensions - 10 rows x 5 columns
-        self.seat_matrix = [[None] * 5 for _ in range(10)]
+        self.strings = [None]
+        self.refs = [0]
+        self.ids = {}
+        self.free_ids = []
+
+    def intern(self, value):
+        """Return the id for a string, adding a reference to it"""
+        if value is None:
+            return 0
+        string_id = self.ids.get(value)
+        if string_id is None:
+            if self.free_ids:
+                string_id = self.free_ids.pop()
+                self.strings[string_id] = value
+            else:
+                string_id = len(self.strings)
+                self.strings.append(value)
+                self.refs.append(0)
+            self.ids[value] = string_id
+        self.refs[string_id] += 1
+        return string_id
+
+    @classmethod
+    def restore(cls, strings, ids_in_use):
+        """A table of captured ``strings`` keeping their ids, one reference per entry of ``ids_in_use``"""
+        table = cls()
+        refs = Counter(ids_in_use)
+        table.strings = list(strings)
+        table.refs = [refs[string_id] for string_id in range(len(strings))]
+        table.refs[0] = 0
+        for string_id in range(1, len(strings)):
+            if table.refs[string_id]:
+                table.ids[table.strings[string_id]] = string_id
+            else:
+                table.strings[string_id] = None
+                table.free_ids.append(string_id)
+        return table
+
+    def release(self, string_id):
+        """Drop a reference, recycling the id once nothing uses it"""
+        if string_id == 0:
+            return
+        self.refs[string_id] -= 1
+        if self.refs[string_id] == 0:
+            del self.ids[self.strings[string_id]]
+            self.strings[string_id] = None
+            self.free_ids.append(string_id)
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+
+class SeatScores:
+    """Precomputed desirability of every seat; lower scores are better
+
+    A seat scores its distance from the stage (row 0) plus its distance
+    from the centre line, each scaled to the venue size. Because the score
+    splits into a row part and a column part, the best any block of ``k``
+    seats in a row can do is known up front and used to prune searches.
+    """
+
+    def __init__(self, rows, cols):
+        centre = (cols - 1) / 2
+        self.cols = cols
+        self.row_terms = [row / rows for row in range(rows)]
+        self.col_terms = [abs(col - centre) / cols for col in range(cols)]
+        self.scores = array('d', (r + c for r in self.row_terms for c in self.col_terms))
+        # Prefix sums of the column part, so any window's sum is O(1)
+        self.col_prefix = [0.0]
+        for term in self.col_terms:
+            self.col_prefix.append(self.col_prefix[-1] + term)
+        # Smallest column part of any block of k adjacent seats
+        self.best_block_cols = [0.0] + [
+            min(self.col_prefix[start + k] - self.col_prefix[start] for start in range(cols - k + 1))
+            for k in range(1, cols + 1)
+        ]
+
+    def block_bound(self, row, count):
+        """Lowest score a block of ``count`` seats in ``row`` could have"""
+        return count * self.row_terms[row] + self.best_block_cols[count]
+
+    def block_score(self, row, first_col, count):
+        return count * self.row_terms[row] + self.col_prefix[first_col + count] - self.col_prefix[first_col]
+
+
+class OccupancyCounters:
+    """Available, reserved and confirmed seat counts
+
+    Updated on every seat transition so reads are O(1) and need no lock.
+    ``lock`` guards updates when several sections share one set of
+    counters; a section's own counters are covered by its section lock.
+    """
+
+    def __init__(self, capacity, lock=None):
+        self.capacity = capacity
+        self.lock = lock
+        self.reset()
+
+    def reset(self):
+        self.available = self.capacity
+        self.reserved = 0  # held or awaiting payment
+        self.confirmed = 0
+
+    def _adjust(self, status, delta):
+        if status == FREE:
+            self.available += delta
+        elif status == CONFIRMED:
+            self.confirmed += delta
+        else:
+            self.reserved += delta
+
+    def move(self, old_status, new_status):
+        """Account for one seat going from ``old_status`` to ``new_status``"""
+        if old_status == new_status:
+            return
+        if self.lock is None:
+            self._adjust(old_status, -1)
+            self._adjust(new_status, 1)
+        else:
+            with self.lock:
+                self._adjust(old_status, -1)
+                self._adjust(new_status, 1)
+
+    def as_dict(self):
+        return {
+            "capacity": self.capacity,
+            "available": self.available,
+            "reserved": self.reserved,
+            "confirmed": self.confirmed
+        }
+
+
+class FreeRunTree:
+    """Segment tree over one row tracking runs of adjacent free seats
+
+    Each node stores the free run touching its left edge, the run touching
+    its right edge and the longest run inside it, so marking a seat costs
+    O(log cols) and the leftmost run of ``k`` free seats is found in
+    O(log cols).
+    """
+
+    # Built once per row width and copied for every fully free row
+    _all_free = {}
+
+    def __init__(self, size, free=None):
+        self.size = size
+        leaves = 1
+        while leaves < size:
+            leaves *= 2
+        self.leaves = leaves
+        self.load(free if free is not None else b'\x01' * size)
+
+    def load(self, free):
+        """Set every seat from one flag per seat (1 = free)
+
+        Fully free and fully taken rows are copied or zero-filled; other
+        rows are rebuilt bottom-up in O(cols).
+        """
+        empty = bytes(4 * 2 * self.leaves)
+        if not any(free):
+            self.prefix, self.suffix, self.best = array('I', empty), array('I', empty), array('I', empty)
+            return
+        all_free = all(free)
+        if all_free:
+            template = FreeRunTree._all_free.get(self.size)
+            if template is not None:
+                self.prefix, self.suffix, self.best = (array('I', column) for column in template)
+                return
+        self.prefix, self.suffix, self.best = array('I', empty), array('I', empty), array('I', empty)
+        # Padding leaves past the end of the row stay 0, i.e. taken
+        leaves = self.leaves
+        for pos, flag in enumerate(free):
+            node = leaves + pos
+            self.prefix[node] = self.suffix[node] = self.best[node] = 1 if flag else 0
+        width = 1
+        level_start = leaves
+        while level_start > 1:
+            width *= 2
+            level_start //= 2
+            for node in range(level_start, 2 * level_start):
+                self._pull(node, width)
+        if all_free:
+            FreeRunTree._all_free[self.size] = (array('I', self.prefix), array('I', self.suffix),
+                                                array('I', self.best))
+
+    def _pull(self, node, width):
+        """Recompute a node of ``width`` seats from its two children"""
+        left, right = 2 * node, 2 * node + 1
+        half = width // 2
+        prefix, suffix, best = self.prefix, self.suffix, self.best
+        prefix[node] = prefix[left] if prefix[left] < half else half + prefix[right]
+        suffix[node] = suffix[right] if suffix[right] < half else half + suffix[left]
+        best[node] = max(best[left], best[right], suffix[left] + prefix[right])
+
+    def set(self, pos, free):
+        """Mark one seat in the row as free or taken"""
+        node = self.leaves + pos
+        value = 1 if free else 0
+        self.prefix[node] = self.suffix[node] = self.best[node] = value
+        width = 1
+        node //= 2
+        while node:
+            width *= 2
+            self._pull(node, width)
+            node //= 2
+
+    @property
+    def longest(self):
+        return self.best[1]
+
+    def find(self, count):
+        """Column where the leftmost run of ``count`` free seats starts, or -1"""
+        if count <= 0 or self.best[1] < count:
+            return -1
+        node, start, width = 1, 0, self.leaves
+        while node < self.leaves:
+            left, right = 2 * node, 2 * node + 1
+            half = width // 2
+            if self.best[left] >= count:
+                node, width = left, half
+            elif self.suffix[left] + self.prefix[right] >= count:
+                return start + half - self.suffix[left]
+            else:
+                node, start, width = right, start + half, half
+        return start
+
+
+class Epoch:
+    """Reset generation of an inventory, shared by all of its sections"""
+
+    def __init__(self):
+        self.value = 0
+
+
+class EpochLock:
+    """A section lock that first brings its section up to the current epoch
+
+    A reset only bumps the epoch; each section is wiped by whoever takes
+    its lock next, so ``raw`` is for the reset itself.
+    """
+
+    def __init__(self, section):
+        self.section = section
+        self.raw = threading.Lock()
+
+    def acquire(self):
+        self.raw.acquire()
+        try:
+            self.section.catch_up()
+        except BaseException:
+            self.raw.release()
+            raise
+
+    def release(self):
+        self.raw.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SeatSection:
+    """A band of rows with its own lock, free-seat heap and seat columns
+
+    Seat state is kept in parallel compact columns indexed by the seat's
+    position within the section rather than as one dict per seat: a status
+    byte, interned holder and session ids, a payment method code and the
+    payment completion time. Dicts are only built when a seat is shown.
+    """
+
+    def __init__(self, first_row, last_row, cols, totals=None, on_change=None, scores=None, epoch=None):
+        self.first_row = first_row
+        self.last_row = last_row  # exclusive
+        self.cols = cols
+        self.offset = first_row * cols
+        self.size = (last_row - first_row) * cols
+        self.lock = EpochLock(self)
+        # The inventory's reset generation, and the one this section's
+        # columns belong to
+        self.venue_epoch = epoch or Epoch()
+        self.epoch = self.venue_epoch.value
+        self.counters = OccupancyCounters(self.size)
+        # Bumped every time a seat is held, so a provisional hold can tell
+        # whether the seat was released and claimed again behind its back.
+        # Kept across resets, so a hold from before one never matches.
+        self.claims = array('I', bytes(4 * self.size))
+        # Inventory-wide counters shared with the other sections
+        self.totals = totals
+        # Called as on_change(section, row, col) after every seat change
+        self.on_change = on_change
+        self.scores = scores or SeatScores(last_row, cols)
+        self.reset()
+
+    def _changed(self, row, col):
+        if self.on_change is not None:
+            self.on_change(self, row, col)
+
+    def _move(self, k, new_status):
+        """Set a seat's status, keeping the occupancy counters in step"""
+        old_status = self.status[k]
+        self.status[k] = new_status
+        self.counters.move(old_status, new_status)
+        if self.totals is not None:
+            self.totals.move(old_status, new_status)
+
+    def reset(self):
+        """Empty every seat in the section (caller holds the lock)"""
+        size = self.size
+        self.status = bytearray(size)
+        self.holders = array('I', bytes(4 * size))
+        self.sessions = array('I', bytes(4 * size))
+        self.methods = bytearray(size)
+        self.completed_at = array('d', bytes(8 * size))
+        self.holder_names = StringTable()
+        self.session_ids = StringTable()
+
+        # Seats are keyed by their row-major index, so the heap hands out the
+        # same "first free seat" the old nested scan did, in O(log n).
+        # Seats claimed directly by position stay in the heap and are
+        # skipped when popped; in_heap stops a seat being pushed twice.
+        self.free_seats = list(range(self.offset, self.offset + size))
+        heapq.heapify(self.free_seats)
+        self.in_heap = bytearray(b'\x01') * size
+        self.counters.reset()
+
+        # Free seats ordered by score for best-available requests; built on
+        # first use so sections only sold in order never pay for it
+        self.best_seats = None
+        self.in_best_heap = None
+
+        # Longest runs of adjacent free seats, one tree per row
+        self.runs = [FreeRunTree(self.cols) for _ in range(self.first_row, self.last_row)]
+        self.epoch = self.venue_epoch.value
+
+    def catch_up(self):
+        """Wipe the section if the venue was reset since it was last touched (caller holds the lock)"""
+        if self.epoch != self.venue_epoch.value:
+            self.reset()
+
+    @property
+    def available(self):
+        """Free seats, read without the lock; a section a reset hasn't reached yet is empty"""
+        if self.epoch != self.venue_epoch.value:
+            return self.size
+        return self.counters.available
+
+    def occupancy(self):
+        """Section counters as a dict, read without the lock"""
+        if self.epoch != self.venue_epoch.value:
+            return OccupancyCounters(self.size).as_dict()
+        return self.counters.as_dict()
+
+    def capture(self):
+        """Copy the seat columns for a snapshot (caller holds the lock)"""
+        return (
+            bytes(self.status), bytes(self.methods), self.completed_at.tobytes(),
+            self.holders.tobytes(), list(self.holder_names.strings),
+            self.sessions.tobytes(), list(self.session_ids.strings),
+        )
+
+    def load(self, status, methods, completed_at, holders, holder_strings, sessions, session_strings):
+        """Restore the columns from ``capture()`` output (caller holds the lock)
+
+        Provisional holds are never journalled, so held seats come back
+        free. String ids keep their captured values, with references
+        counted from the seats still taken, and the free-seat heap, run
+        trees and counters are rebuilt in one pass over the section.
+        """
+        self.reset()
+        held = [k for k, code in enumerate(status) if code == HELD] if HELD in status else []
+        status = bytearray(status).translate(bytes.maketrans(bytes([HELD]), bytes([FREE])))
+        self.holders, self.sessions = array('I', holders), array('I', sessions)
+        for k in held:
+            self.holders[k] = self.sessions[k] = 0
+        self.holder_names = StringTable.restore(holder_strings, compress(self.holders, status))
+        self.session_ids = StringTable.restore(session_strings, compress(self.sessions, status))
+        self.status = status
+        self.methods = bytearray(methods)
+        self.completed_at = array('d', completed_at)
+
+        # One flag per seat, 1 where the seat is free
+        self.in_heap = status.translate(bytes([1]) + bytes(255))
+        self.free_seats = [self.offset + k for k, flag in enumerate(self.in_heap) if flag]  # sorted, so a heap
+        for offset, runs in enumerate(self.runs):
+            runs.load(self.in_heap[offset * self.cols:(offset + 1) * self.cols])
+        self.counters.available = status.count(FREE)
+        self.counters.reserved = status.count(RESERVED)
+        self.counters.confirmed = status.count(CONFIRMED)
+
+    def _index(self, row, col):
+        return row * self.cols + col - self.offset
+
+    def pop_free_seat(self):
+        """Take the lowest free seat off the heap, or None if the section is full"""
+        while self.free_seats:
+            seat = heapq.heappop(self.free_seats)
+            k = seat - self.offset
+            self.in_heap[k] = 0
+            if self.status[k] == FREE:
+                return divmod(seat, self.cols)
+        return None
+
+    def push_free_seat(self, row, col):
+        """Return a seat to the free-seat heaps"""
+        k = self._index(row, col)
+        seat = row * self.cols + col
+        if not self.in_heap[k]:
+            self.in_heap[k] = 1
+            heapq.heappush(self.free_seats, seat)
+        if self.best_seats is not None and not self.in_best_heap[k]:
+            self.in_best_heap[k] = 1
+            heapq.heappush(self.best_seats, (self.scores.scores[seat], seat))
+
+    def _build_best_seats(self):
+        scores = self.scores.scores
+        self.best_seats = [
+            (scores[self.offset + k], self.offset + k)
+            for k in range(self.size) if self.status[k] == FREE
+        ]
+        heapq.heapify(self.best_seats)
+        self.in_best_heap = bytearray(self.size)
+        for _, seat in self.best_seats:
+            self.in_best_heap[seat - self.offset] = 1
+
+    def best_hint(self):
+        """Lower bound on the best free seat's score, read without the lock"""
+        heap = self.best_seats
+        if heap is None or self.epoch != self.venue_epoch.value:
+            return self.scores.block_bound(self.first_row, 1)
+        try:
+            return heap[0][0]
+        except IndexError:
+            return float('inf')
+
+    def pop_best_seat(self, limit=float('inf')):
+        """Take the best-scoring free seat if it scores no worse than ``limit``
+
+        Returns None if the section is full or its best seat is worse than
+        ``limit``; stale heap entries are dropped either way, so the hint
+        is exact afterwards.
+        """
+        if self.best_seats is None:
+            self._build_best_seats()
+        heap = self.best_seats
+        while heap and self.status[heap[0][1] - self.offset] != FREE:
+            self.in_best_heap[heapq.heappop(heap)[1] - self.offset] = 0
+        if not heap or heap[0][0] > limit:
+            return None
+        seat = heapq.heappop(heap)[1]
+        self.in_best_heap[seat - self.offset] = 0
+        return divmod(seat, self.cols)
+
+    def best_block(self, count, limit=float('inf')):
+        """Best-scoring run of ``count`` free seats scoring below ``limit``
+
+        Rows are visited front to back and the search stops once a row's
+        lowest possible block score can't beat the best found. Returns
+        ``(score, row, first_col)`` or None.
+        """
+        best = None
+        cols = self.cols
+        for offset in range(self.last_row - self.first_row):
+            row = self.first_row + offset
+            if self.scores.block_bound(row, count) >= limit:
+                break
+            if not self._has_run(offset, count):
+                continue
+            status = self.status[offset * cols:(offset + 1) * cols]
+            taken = sum(1 for code in status[:count] if code != FREE)
+            for first_col in range(cols - count + 1):
+                if first_col:
+                    taken += (status[first_col + count - 1] != FREE) - (status[first_col - 1] != FREE)
+                if taken:
+                    continue
+                score = self.scores.block_score(row, first_col, count)
+                if score < limit:
+                    limit = score
+                    best = (score, row, first_col)
+        return best
+
+    def _has_run(self, offset, count):
+        """Whether the ``offset``-th row of the section has ``count`` adjacent free seats"""
+        return self.runs[offset].longest >= count
+
+    def status_of(self, row, col):
+        return self.status[self._index(row, col)]
+
+    def hold(self, row, col, name):
+        """Mark a seat as provisionally held and return its claim number"""
+        k = self._index(row, col)
+        self._move(k, HELD)
+        self.runs[row - self.first_row].set(col, False)
+        self.holders[k] = self.holder_names.intern(name)
+        self.claims[k] = (self.claims[k] + 1) & 0xFFFFFFFF
+        self._changed(row, col)
+        return self.claims[k]
+
+    def is_held(self, row, col, claim):
+        """Whether a seat is still under the provisional hold ``claim``"""
+        k = self._index(row, col)
+        return self.status[k] == HELD and self.claims[k] == claim
+
+    def reserve(self, row, col, session_id):
+        """Attach a payment session to a held seat"""
+        k = self._index(row, col)
+        self._move(k, RESERVED)
+        self.sessions[k] = self.session_ids.intern(session_id)
+        self._changed(row, col)
+
+    def session_of(self, row, col):
+        return self.session_ids[self.sessions[self._index(row, col)]]
+
+    def confirm(self, row, col, payment_method, completed_at):
+        """Mark a reserved seat as paid for"""
+        k = self._index(row, col)
+        self._move(k, CONFIRMED)
+        self.methods[k] = PAYMENT_METHOD_CODES.get(payment_method, PAYMENT_METHOD_CODES["unknown"])
+        self.completed_at[k] = completed_at.timestamp() if completed_at else 0.0
+        self._changed(row, col)
+
+    def clear(self, row, col):
+        """Empty a seat and return it to the free-seat heap"""
+        k = self._index(row, col)
+        self.holder_names.release(self.holders[k])
+        self.session_ids.release(self.sessions[k])
+        self._move(k, FREE)
+        self.holders[k] = 0
+        self.sessions[k] = 0
+        self.methods[k] = 0
+        self.completed_at[k] = 0.0
+        self.runs[row - self.first_row].set(col, True)
+        self.push_free_seat(row, col)
+        self._changed(row, col)
+
+    def find_block(self, count):
+        """Leftmost run of ``count`` adjacent free seats as (row, col), or None"""
+        for offset, runs in enumerate(self.runs):
+            if runs.longest >= count:
+                return self.first_row + offset, runs.find(count)
+        return None
+
+    def seat(self, row, col, date):
+        """Materialize one seat in the JSON shape served to clients"""
+        return self._seat_at(self._index(row, col), date)
+
+    def rows(self, date):
+        """Every row of the section as a tuple of materialized seats"""
+        seat_at = self._seat_at
+        seats = [seat_at(k, date) if code != FREE else None for k, code in enumerate(self.status)]
+        return [tuple(seats[start:start + self.cols]) for start in range(0, self.size, self.cols)]
+
+    def _seat_at(self, k, date):
+        status = self.status[k]
+        if status == FREE:
+            return None
+        seat = {
+            "name": self.holder_names[self.holders[k]],
+            "date": date,
+            "session_id": self.session_ids[self.sessions[k]],
+            "status": STATUS_NAMES[status]
+        }
+        if status == CONFIRMED:
+            seat["payment_method"] = PAYMENT_METHODS[self.methods[k]]
+            seat["payment_completed_at"] = (
+                datetime.fromtimestamp(self.completed_at[k]) if self.completed_at[k] else None
+            )
+        return seat
+
+
+class SeatInventory:
+    """Seats, locks and indexes for a single show date
+
+    Rows are striped into sections of ``section_rows`` rows. Each section
+    owns its lock and free seats, so reservations in different sections
+    never wait on each other; only whole-venue operations take every lock.
+
+    Every seat change publishes a new immutable ``(version, rows)``
+    snapshot, rebuilding only the row that changed. Readers take the
+    current snapshot without locking or copying; the seat dicts in it are
+    never modified after publication. The last ``CHANGE_LOG_SIZE`` changes
+    are kept in a change log so pollers can fetch just the difference.
+    """
+
+    def __init__(self, date, rows=DEFAULT_ROWS, cols=DEFAULT_COLS, section_rows=DEFAULT_SECTION_ROWS,
+                 on_hold=None):
+        self.date = date
+        # Called as on_hold(session_id, expires_at) for every new payment hold
+        self.on_hold = on_hold
+        self.rows = rows
+        self.cols = cols
+        self.section_rows = section_rows
+        self.totals = OccupancyCounters(rows * cols, threading.Lock())
+        self.scores = SeatScores(rows, cols)
+        # Bumped by every reset; sections catch up lazily under their lock
+        self.epoch = Epoch()
+        self.sections = [
+            SeatSection(first, min(first + section_rows, rows), cols, self.totals, self._seat_changed,
+                        self.scores, self.epoch)
+            for first in range(0, rows, section_rows)
+        ]
+        self._reset_session_index()
+        self._publish_lock = threading.Lock()
+        self._empty_rows = ((None,) * cols,) * rows
+        self.snapshot = (0, self._empty_rows)
+        self.changes = deque(maxlen=CHANGE_LOG_SIZE)  # (version, row, col, seat)
+        # Every change after this version is still in the log
+        self.changes_from = 0
+        # Optional WriteAheadLog recording every seat transition
+        self.journal = None
+        # Optional Pricing quoting each seat's tier and price
+        self.pricing = None
+
+    @property
+    def version(self):
+        return self.snapshot[0]
+
+    def _seat_changed(self, section, row, col):
+        """Publish a snapshot with one seat replaced (caller holds the section lock)"""
+        seat = section.seat(row, col, self.date)
+        with self._publish_lock:
+            version, rows = self.snapshot
+            old_row = rows[row]
+            new_row = old_row[:col] + (seat,) + old_row[col + 1:]
+            self.snapshot = (version + 1, rows[:row] + (new_row,) + rows[row + 1:])
+            if len(self.changes) == self.changes.maxlen:
+                self.changes_from = self.changes[0][0]
+            self.changes.append((version + 1, row, col, seat))
+
+    @contextmanager
+    def _all_sections(self):
+        """Hold every section lock, always acquired in section order"""
+        with ExitStack() as stack:
+            for section in self.sections:
+                stack.enter_context(section.lock)
+            yield
+
+    def _section(self, row):
+        return self.sections[row // self.section_rows]
+
+    def _log(self, op, **fields):
+        """Journal a seat transition (caller holds the lock that ordered it)"""
+        if self.journal is not None:
+            self.journal.append(op, date=self.date, **fields)
+
+    def _sync(self):
+        """Wait for journalled transitions to be durable (caller holds no lock)"""
+        if self.journal is not None:
+            self.journal.sync()
+
+    def _reset_session_index(self):
+        """Drop all session -> seat mappings (caller holds every section lock)"""
+        # Shared by all sections; an entry is only written under the lock of
+        # the section that owns its seats. The reverse mapping is each
+        # section's session column.
+        self.session_seats = {}  # session_id -> ((row, col), ...)
+
+    def reserve(self, name):
+        """Reserve the first free seat and create payment session"""
+        # Skip sections that look full without locking them; a section that
+        # fills up between the check and the lock is simply passed over.
+        for section in self.sections:
+            if not section.available:
+                continue
+            with section.lock:
+                position = section.pop_free_seat()
+                if position is None:
+                    continue
+                claim = section.hold(*position, name)
+            return self._attach_payment(section, [position], [claim], name)
+
+        return {"success": False, "message": "No seats available"}, 200
+
+    def reserve_at(self, name, row, col):
+        """Claim one specific seat if it is still free (compare-and-set)"""
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return {"error": f"Seat ({row},{col}) does not exist"}, 400
+
+        section = self._section(row)
+        with section.lock:
+            if section.status_of(row, col) != FREE:
+                return {
+                    "success": False,
+                    "message": f"Seat at ({row},{col}) is already taken"
+                }, 409
+            claim = section.hold(row, col, name)
+        return self._attach_payment(section, [(row, col)], [claim], name)
+
+    def reserve_block(self, name, count):
+        """Claim ``count`` adjacent seats in one row under one payment session"""
+        if not 1 <= count <= self.cols:
+            return {"error": f"Group size must be between 1 and {self.cols}"}, 400
+
+        for section in self.sections:
+            if section.available < count:
+                continue
+            with section.lock:
+                start = section.find_block(count)
+                if start is None:
+                    continue
+                row, first_col = start
+                positions = [(row, col) for col in range(first_col, first_col + count)]
+                claims = [section.hold(r, c, name) for r, c in positions]
+            return self._attach_payment(section, positions, claims, name)
+
+        return {"success": False, "message": f"No block of {count} adjacent seats available"}, 200
+
+    def reserve_best(self, name):
+        """Reserve the best-scoring free seat in the venue"""
+        while True:
+            # Sections are ranked by a lock-free lower bound on their best
+            # seat; the leader is accepted only if its real best still beats
+            # the runner-up's bound, otherwise the ranking is refreshed
+            ranked = sorted(
+                (section.best_hint(), index)
+                for index, section in enumerate(self.sections)
+                if section.available
+            )
+            if not ranked:
+                return {"success": False, "message": "No seats available"}, 200
+            section = self.sections[ranked[0][1]]
+            runner_up = ranked[1][0] if len(ranked) > 1 else float('inf')
+            with section.lock:
+                position = section.pop_best_seat(runner_up)
+                if position is None:
+                    continue
+                claim = section.hold(*position, name)
+            return self._attach_payment(section, [position], [claim], name)
+
+    def reserve_best_block(self, name, count):
+        """Reserve the best-scoring block of ``count`` adjacent seats in a row"""
+        if not 1 <= count <= self.cols:
+            return {"error": f"Group size must be between 1 and {self.cols}"}, 400
+
+        while True:
+            best = None
+            for section in self.sections:
+                if section.available < count:
+                    continue
+                # Sections run front to back, so bounds only get worse
+                if best is not None and self.scores.block_bound(section.first_row, count) >= best[0]:
+                    break
+                with section.lock:
+                    found = section.best_block(count, best[0] if best else float('inf'))
+                if found is not None:
+                    best = found + (section,)
+
+            if best is None:
+                return {"success": False, "message": f"No block of {count} adjacent seats available"}, 200
+
+            score, row, first_col, section = best
+            positions = [(row, col) for col in range(first_col, first_col + count)]
+            with section.lock:
+                # Another request may have taken part of the block since the search
+                if any(section.status_of(r, c) != FREE for r, c in positions):
+                    continue
+                claims = [section.hold(r, c, name) for r, c in positions]
+            return self._attach_payment(section, positions, claims, name)
+
+    def _attach_payment(self, section, positions, claims, name):
+        """Create the payment session for held seats and attach it
+
+        Runs outside the section lock so a slow payment backend never
+        stalls other reservations. If the session cannot be created, or a
+        hold or the session vanished meanwhile (e.g. a reset), the claim is
+        rolled back.
+        """
+        i, j = positions[0]
+
+        # Create payment session
+        seat_info = {"row": i, "col": j}
+        if len(positions) > 1:
+            seat_info["seats"] = [{"row": r, "col": c} for r, c in positions]
+        try:
+            session_id, payment_data = payment_system.create_payment_session(
+                seat_info, name, self.date, quantity=len(positions),
+                seat_prices=self.pricing.seat_prices(positions) if self.pricing else None
+            )
+        except Exception:
+            with section.lock:
+                self._drop_holds(section, positions, claims)
+            return {"success": False, "message": "Could not start payment, please try again"}, 503
+
+        with section.lock:
+            if not all(section.is_held(r, c, claim) for (r, c), claim in zip(positions, claims)):
+                self._drop_holds(section, positions, claims)
+                payment_system.cancel_payment_session(session_id)
+                return {"success": False, "message": "Seat is no longer available"}, 409
+            # A reset of the payments since the session was created; its
+            # seats may be from after the reset, so they must not keep it
+            if payment_system.get_payment_session(session_id) is None:
+                self._drop_holds(section, positions, claims)
+                return {"success": False, "message": "Seat is no longer available"}, 409
+
+            # Temporarily reserve the seats
+            for r, c in positions:
+                section.reserve(r, c, session_id)
+            self.session_seats[session_id] = tuple(positions)
+            self._log("reserve", session_id=session_id, name=name, seats=positions)
+            if self.on_hold is not None:
+                self.on_hold(session_id, payment_data['expires_at'])
+
+            seats = [
+                {"row": r, "col": c, "data": section.seat(r, c, self.date)}
+                for r, c in positions
+            ]
+            if len(positions) == 1:
+                message = f"Seat reserved at ({i},{j}) for {name}. Please complete payment."
+            else:
+                message = (f"{len(positions)} seats reserved in row {i} from column {j} "
+                           f"for {name}. Please complete payment.")
+        self._sync()
+        return {
+            "success": True,
+            "message": message,
+            "session_id": session_id,
+            "payment_url": f"/payment/{session_id}",
+            "seat": seats[0],
+            "seats": seats
+        }, 200
+
+    def _drop_holds(self, section, positions, claims):
+        """Roll back provisional holds still in place (caller holds the section lock)"""
+        for (r, c), claim in zip(positions, claims):
+            if section.is_held(r, c, claim):
+                section.clear(r, c)
+
+    def _locked_session(self, session_id):
+        """Lock the section holding a session's seats
+
+        Returns ``(section, positions)`` with the section lock held, or
+        ``(None, None)`` if the session holds no seat. The index is re-read
+        under the lock in case a seat was released in the meantime.
+        """
+        positions = self.session_seats.get(session_id)
+        if positions is None:
+            return None, None
+        section = self._section(positions[0][0])
+        section.lock.acquire()
+        positions = self.session_seats.get(session_id)
+        if positions is None or self._section(positions[0][0]) is not section:
+            section.lock.release()
+            return None, None
+        return section, positions
+
+    def confirm(self, session_id):
+        """Confirm booking after successful payment"""
+        section, positions = self._locked_session(session_id)
+        if section is None:
+            return {
+                "success": False,
+                "message": "Session not found"
+            }, 404
+
+        try:
+            i, j = positions[0]
+
+            # Check if payment is completed
+            payment_success, payment_data = payment_system.check_payment_status(session_id)
+
+            if payment_success:
+                # Mark seats as confirmed
+                payment_method = payment_data.get('payment_method', 'unknown')
+                completed_at = payment_data.get('completed_at')
+                for r, c in positions:
+                    section.confirm(r, c, payment_method, completed_at)
+                self._log("confirm", session_id=session_id, payment_method=payment_method,
+                          completed_at=completed_at.timestamp() if completed_at else None)
+
+                seats = [
+                    {"row": r, "col": c, "data": section.seat(r, c, self.date)}
+                    for r, c in positions
+                ]
+                result = {
+                    "success": True,
+                    "message": f"Booking confirmed for seat at ({i},{j})"
+                               if len(positions) == 1 else
+                               f"Booking confirmed for {len(positions)} seats in row {i}",
+                    "seat": seats[0],
+                    "seats": seats
+                }, 200
+            else:
+                return {
+                    "success": False,
+                    "message": "Payment not completed"
+                }, 400
+        finally:
+            section.lock.release()
+        self._sync()
+        return result
+
+    def _release(self, section, row, col):
+        """Clear a seat and return it to the pool (caller holds the section lock)"""
+        session_id = section.session_of(row, col)
+        if session_id is not None:
+            # Other seats booked under the same session keep their entry
+            positions = self.session_seats.pop(session_id, ())
+            remaining = tuple(p for p in positions if p != (row, col))
+            if remaining:
+                self.session_seats[session_id] = remaining
+        section.clear(row, col)
+        self._log("release", row=row, col=col)
+        return {"success": True, "message": f"Seat at ({row},{col}) released", "session_id": session_id}, 200
+
+    def release_seat(self, row, col):
+        """Release a held seat back to the pool"""
+        section = self._section(row)
+        with section.lock:
+            if section.status_of(row, col) == FREE:
+                return {"success": False, "message": "Seat is not reserved"}, 404
+            result = self._release(section, row, col)
+        self._sync()
+        return result
+
+    def release_session(self, session_id):
+        """Release every seat held by a payment session"""
+        section, positions = self._locked_session(session_id)
+        if section is None:
+            return {"success": False, "message": "Session not found"}, 404
+        try:
+            for r, c in positions:
+                result = self._release(section, r, c)
+        finally:
+            section.lock.release()
+        self._sync()
+        if len(positions) == 1:
+            return result
+        return {"success": True, "message": f"Released {len(positions)} seats"}, 200
+
+    def expire_sessions(self, session_ids):
+        """Release the unpaid seats of expired sessions
+
+        Sessions are grouped by section so each section lock is taken once
+        per batch. Confirmed seats are never released. Returns the freed
+        seats as ``{"row", "col", "data": None}``.
+        """
+        by_section = {}
+        for session_id in session_ids:
+            positions = self.session_seats.get(session_id)
+            if positions:
+                by_section.setdefault(self._section(positions[0][0]), []).append(session_id)
+
+        released = []
+        for section, section_sessions in by_section.items():
+            with section.lock:
+                for session_id in section_sessions:
+                    for r, c in self.session_seats.get(session_id, ()):
+                        if (section.status_of(r, c) in (HELD, RESERVED)
+                                and section.session_of(r, c) == session_id):
+                            self._release(section, r, c)
+                            released.append({"row": r, "col": c, "data": None})
+        self._sync()
+        return released
+
+    def release_unpaid(self):
+        """Release every held or reserved seat; returns how many were freed"""
+        released = 0
+        with self._all_sections():
+            for section in self.sections:
+                for row in range(section.first_row, section.last_row):
+                    for col in range(self.cols):
+                        if section.status_of(row, col) in (HELD, RESERVED):
+                            self._release(section, row, col)
+                            released += 1
+        self._sync()
+        return released
+
+    def release_orphaned_sessions(self):
+        """Release the seats of sessions the payment system no longer knows
+
+        Every section lock is taken first, so a hold still being attached
+        is either finished and released here or sees its session gone.
+        """
+        with self._all_sections():
+            for session_id, positions in list(self.session_seats.items()):
+                if payment_system.get_payment_session(session_id) is None:
+                    section = self._section(positions[0][0])
+                    for r, c in positions:
+                        # Paid seats stay even once their session is cleaned up
+                        if (section.status_of(r, c) in (HELD, RESERVED)
+                                and section.session_of(r, c) == session_id):
+                            self._release(section, r, c)
+        self._sync()
+
+    def show(self):
+        """Return current seat matrix (an immutable snapshot)"""
+        return self.snapshot[1]
+
+    def changes_since(self, since):
+        """Seats changed after version ``since``
+
+        Returns ``(version, changes)`` where changes holds the latest state
+        of each changed seat as ``{"row", "col", "data"}``, or
+        ``(version, None)`` if the log no longer reaches back to ``since``.
+        """
+        with self._publish_lock:
+            version = self.snapshot[0]
+            if since < self.changes_from or since > version:
+                return version, None
+            latest = {}
+            for change_version, row, col, seat in reversed(self.changes):
+                if change_version <= since:
+                    break
+                latest.setdefault((row, col), seat)
+        changes = [{"row": row, "col": col, "data": seat} for (row, col), seat in latest.items()]
+        return version, changes
+
+    def reset(self):
+        """Empty every seat in the venue
+
+        Only the epoch is bumped; each section wipes its own columns the
+        next time its lock is taken. Every section lock is still held
+        briefly so no transition straddles the reset, but the work under
+        them doesn't grow with the number of seats.
+        """
+        with ExitStack() as stack:
+            for section in self.sections:
+                stack.enter_context(section.lock.raw)
+            self.epoch.value += 1
+            self.totals.reset()
+            self._reset_session_index()
+            with self._publish_lock:
+                self.snapshot = (self.snapshot[0] + 1, self._empty_rows)
+                # A reset touches every seat; older versions need a full reload
+                self.changes.clear()
+                self.changes_from = self.snapshot[0]
+            self._log("reset")
+        self._sync()
+
+    def apply(self, record):
+        """Redo one journalled seat transition during recovery"""
+        op = record["op"]
+        if op == "reset":
+            self.reset()
+            return
+
+        if op == "release":
+            section = self._section(record["row"])
+            with section.lock:
+                if section.status_of(record["row"], record["col"]) != FREE:
+                    self._release(section, record["row"], record["col"])
+            return
+
+        session_id = record["session_id"]
+        if op == "reserve":
+            positions = tuple((r, c) for r, c in record["seats"])
+            section = self._section(positions[0][0])
+            with section.lock:
+                for r, c in positions:
+                    # Replays on top of a snapshot may find the seat already taken
+                    if section.status_of(r, c) != FREE:
+                        self._release(section, r, c)
+                    section.hold(r, c, record["name"])
+                    section.reserve(r, c, session_id)
+                self.session_seats[session_id] = positions
+        elif op == "confirm":
+            completed_at = record["completed_at"]
+            section, positions = self._locked_session(session_id)
+            if section is None:
+                return
+            try:
+                for r, c in positions:
+                    section.confirm(r, c, record["payment_method"],
+                                    datetime.fromtimestamp(completed_at) if completed_at else None)
+            finally:
+                section.lock.release()
+
+    def status_name(self, row, col):
+        """A seat's status ("reserved", "confirmed", ...), None if it is free"""
+        return STATUS_NAMES[self._section(row).status_of(row, col)]
+
+    def capture(self):
+        """Copy every section's columns for a snapshot
+
+        Sections are copied one at a time under their own lock, so
+        reservations elsewhere carry on; the journal replayed after the
+        snapshot brings any section copied early up to date.
+        """
+        columns = []
+        for section in self.sections:
+            with section.lock:
+                columns.append(section.capture())
+        return columns
+
+    def load(self, columns):
+        """Restore every section from ``capture()`` output
+
+        Rebuilds the totals, the session index and a fresh published
+        snapshot; pollers holding an older version get a full reload.
+        """
+        with self._all_sections():
+            self._reset_session_index()
+            for section, section_columns in zip(self.sections, columns):
+                section.load(*section_columns)
+                session_ids, sessions = section.session_ids.strings, section.sessions
+                for k in compress(range(section.size), section.status):
+                    self.session_seats.setdefault(session_ids[sessions[k]], []).append(
+                        divmod(section.offset + k, self.cols))
+            self.session_seats = {session_id: tuple(positions)
+                                  for session_id, positions in self.session_seats.items()}
+
+            self.totals.available = sum(section.counters.available for section in self.sections)
+            self.totals.reserved = sum(section.counters.reserved for section in self.sections)
+            self.totals.confirmed = sum(section.counters.confirmed for section in self.sections)
+
+            rows = tuple(row for section in self.sections for row in section.rows(self.date))
+            with self._publish_lock:
+                self.snapshot = (self.snapshot[0] + 1, rows)
+                self.changes.clear()
+                self.changes_from = self.snapshot[0]
+
+    def get_available_count(self):
+        """Get count of available seats"""
+        # Counters are maintained on every transition and read without locking
+        return self.totals.available
+
+    def get_booked_count(self):
+        """Get count of booked seats"""
+        return self.totals.reserved + self.totals.confirmed
+
+    def stats(self):
+        """Occupancy counters for the venue and each section"""
+        stats = self.totals.as_dict()
+        stats["date"] = self.date
+        stats["sections"] = [
+            dict(section.occupancy(), first_row=section.first_row, last_row=section.last_row - 1)
+            for section in self.sections
+        ]
+        return stats
+
+
+class TicketBooking:
+    def __init__(self, rows=None, cols=None, section_rows=None, layout_file=None, hold_expiry=None,
+                 inventory_factory=None, max_holds_per_customer=None, on_promoted=None, price_tiers=None):
+        # Venue dimensions come from a layout file if given, otherwise from
+        # the arguments, falling back to 10 rows x 5 columns per show date
+        if layout_file:
+            rows, cols, section_rows = load_venue_layout(layout_file)
+            price_tiers = price_tiers or load_price_tiers(layout_file)
+        self.rows = rows or DEFAULT_ROWS
+        self.cols = cols or DEFAULT_COLS
+        self.section_rows = section_rows or DEFAULT_SECTION_ROWS  # rows per lock stripe
+        self.inventories = {}  # date -> SeatInventory, created on first use
         self.lock = threading.Lock()
+        # Optional HoldExpiryScheduler told about every new hold
+        self.hold_expiry = hold_expiry
+        # Builds a date's inventory, called with the same arguments as
+        # SeatInventory; lets several processes share one seat map
+        self.inventory_factory = inventory_factory or SeatInventory
+        # WriteAheadLog handed to every inventory once recovery is done
+        self.journal = None
+        # Holds and bookings per customer, with an optional cap on unpaid seats
+        self.customers = CustomerIndex(max_holds_per_customer)
+        self.waitlists = {}  # date -> Waitlist, created on first use
+        # Called as on_promoted(entry) when a waitlisted customer is handed seats
+        self.on_promoted = on_promoted
+        # Seat prices by tier (see pricing.PriceTable.from_config); every
+        # seat costs the default price without tiers
+        self.pricing = Pricing(PriceTable.from_config(self.rows, self.cols, price_tiers or []))
+        # Served for dates nothing was ever reserved for
+        self._empty_rows = ((None,) * self.cols,) * self.rows
+
+    @property
+    def capacity(self):
+        return self.rows * self.cols
 
-    def reserve_seat(self, name, date):
-        """Reserve a seat and create payment session"""
+    def _inventory(self, date):
+        """Get the inventory for a date, creating it on first use"""
+        inventory = self.inventories.get(date)
+        if inventory is None:
+            with self.lock:
+                inventory = self.inventories.get(date)
+                if inventory is None:
+                    inventory = self.inventory_factory(date, self.rows, self.cols, self.section_rows,
+                                                       on_hold=self._hold_placed)
+                    inventory.journal = self.journal
+                    inventory.pricing = self.pricing
+                    self.inventories[date] = inventory
+        return inventory
+
+    def release_stored_holds(self):
+        """Free the unpaid seats a persistent storage backend kept over a restart
+
+        Payment sessions, expiry timers and the customer index live in this
+        process, so a hold stored by the previous run could never be paid,
+        cancelled or expired. Returns how many seats were freed.
+        """
+        released = 0
+        for date in self.inventory_factory.dates():
+            released += self._inventory(date).release_unpaid()
+        return released
+
+    def _waitlist(self, date):
+        """Get the waitlist for a date, creating it on first use"""
+        waitlist = self.waitlists.get(date)
+        if waitlist is None:
+            with self.lock:
+                waitlist = self.waitlists.setdefault(date, Waitlist(date))
+        return waitlist
+
+    def _hold_placed(self, session_id, expires_at):
+        if self.hold_expiry is not None:
+            self.hold_expiry.schedule(session_id, expires_at)
+
+    def capture(self):
+        """Copy every show date's seats for a snapshot
+
+        Returns ``(date, rows, cols, section_rows, columns)`` per date.
+        """
+        with self.lock:
+            inventories = list(self.inventories.values())
+        return [
+            (inventory.date, inventory.rows, inventory.cols, inventory.section_rows, inventory.capture())
+            for inventory in inventories
+        ]
+
+    def recover(self, journal, snapshot_path=None):
+        """Rebuild seats and payment sessions, then log to ``journal``
+
+        State comes from the snapshot at ``snapshot_path`` if there is one,
+        followed by a replay of the journal. Unpaid holds get their expiry
+        timers back; those whose payment window ran out while the server
+        was down are released at once.
+        """
+        # Recovery allocates a dict or tuple per seat and session, none of
+        # them cyclic; collections it set off would only rescan them all
+        with gc_paused():
+            if snapshot_path and os.path.exists(snapshot_path):
+                inventories, sessions, epoch = read_snapshot(snapshot_path)
+                payment_system.load(sessions, epoch)
+                for date, rows, cols, section_rows, columns in inventories:
+                    if (rows, cols, section_rows) != (self.rows, self.cols, self.section_rows):
+                        raise ValueError(f"Snapshot {snapshot_path} was taken with a {rows}x{cols} venue "
+                                         f"striped by {section_rows} rows")
+                    self._inventory(date).load(columns)
+
+            for record in journal.replay():
+                if record["op"].startswith("payment_"):
+                    payment_system.apply(record)
+                else:
+                    self._inventory(record["date"]).apply(record)
+
+            payment_system.journal = journal
+            with self.lock:
+                self.journal = journal
+                inventories = list(self.inventories.values())
+            for inventory in inventories:
+                inventory.journal = journal
+                for session_id in list(inventory.session_seats):
+                    session = payment_system.get_payment_session(session_id)
+                    if session and session['status'] == 'pending':
+                        self._hold_placed(session_id, session['expires_at'])
+            self._index_customers(inventories)
+
+    def _index_customers(self, inventories):
+        """Rebuild the customer index from the recovered payment sessions
+
+        Each session still holding seats names its customer, so this costs
+        a lookup per session rather than a pass over every seat.
+        """
+        by_date = {inventory.date: inventory for inventory in inventories}
+        bookings = []
+        for session in payment_system.recovered_sessions():
+            inventory = by_date.get(session["date"])
+            positions = inventory.session_seats.get(session["session_id"]) if inventory else None
+            if positions:
+                bookings.append((session["user_name"], session["session_id"], inventory.date, positions,
+                                 inventory.status_name(*positions[0])))
+        self.customers.restore(bookings)
+
+    def _shown_inventory(self, date):
+        """Inventory for a read-only query (no date means today's show)
+
+        Returns None for a date without an inventory: reads never create
+        one, so looking dates up costs no memory. A storage backend shared
+        with other processes may already hold the date, in which case it
+        is opened.
+        """
+        date = date or calendar_date.today().isoformat()
+        inventory = self.inventories.get(date)
+        if inventory is None and getattr(self.inventory_factory, "has_date", None) is not None:
+            if self.inventory_factory.has_date(date):
+                inventory = self._inventory(date)
+        return inventory
+
+    def _session_inventory(self, session_id):
+        """Find the inventory a payment session was reserved against"""
+        session = payment_system.get_payment_session(session_id)
+        if not session:
+            return None
+        return self.inventories.get(session['date'])
+
+    def reserve_seat(self, name, date, row=None, col=None, quantity=1, best=False, client=None):
+        """Reserve a seat and create payment session
+
+        With ``row`` and ``col`` that exact seat is claimed or the call fails
+        with a conflict; with ``quantity`` above one that many adjacent
+        seats in a row are held under a single session; otherwise the first
+        free seat is taken. ``best`` picks the best-scoring seat or block
+        instead of the first one. Customers over their hold quota, counted
+        both by name and by ``client`` (the caller's address), are turned
+        away with a 429.
+
+        Customers already on the date's waitlist get first pick of any
+        free seats. When nothing left fits, anything but a specific seat
+        joins the waitlist instead and gets a 202 with the waitlist entry.
+        """
         if not name or not date:
             return {"error": "Missing name or date"}, 400
 
+        if not is_show_date(date):
+            return {"error": "Date must be given as YYYY-MM-DD"}, 400
+
+        # bool is an int subclass, but JSON true is not a seat count
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            return {"error": "Quantity must be a positive integer"}, 400
+
+        if (row is not None or col is not None) and (quantity > 1 or best):
+            return {"error": "A seat position can only be given for a single seat"}, 400
+
+        if row is None and col is None:
+            waitlist = self._waitlist(date)
+            # Freed seats belong to the queue, not to whoever asks next;
+            # only what fits nobody waiting is left for this request
+            self._promote_waitlist(date)
+            result, status_code = self._hold(name, date, row, col, quantity, best, client)
+            if status_code == 200 and not result.get("success"):
+                return self._join_waitlist(waitlist, name, quantity, best, client)
+            return result, status_code
+        return self._hold(name, date, row, col, quantity, best, client)
+
+    def _hold(self, name, date, row, col, quantity, best, client=None):
+        """Reserve within the customer's hold quota and index the new hold"""
+        if not self.customers.acquire_holds(name, quantity, client):
+            return {
+                "success": False,
+                "message": f"You can hold at most {self.customers.max_holds} unpaid seats at a time. "
+                           f"Complete or cancel a payment first."
+            }, 429
+        try:
+            result, status_code = self._reserve(name, date, row, col, quantity, best)
+        except BaseException:
+            self.customers.release_holds(name, quantity, client)
+            raise
+        if result.get("success"):
+            self.customers.add(name, result["session_id"], date, result["seats"], client=client)
+            # Only whoever gets this response (or a promoted waitlist
+            # entry) can cancel the hold
+            result["cancel_token"] = payment_system.cancel_token(result["session_id"])
+            result["payment_url"] += f"?cancel={result['cancel_token']}"
+        else:
+            self.customers.release_holds(name, quantity, client)
+        return result, status_code
+
+    def _join_waitlist(self, waitlist, name, quantity, best, client):
+        entry = waitlist.join(name, quantity, best, client)
+        # Seats freed since the failed attempt found nobody waiting yet
+        self._promote_waitlist(waitlist.date)
+        entry = waitlist.status(entry["waitlist_id"])
+        if entry["status"] == "waiting":
+            message = (f"Sold out. You are number {entry['position']} on the waitlist "
+                       f"and will be sent to payment when seats free up.")
+        else:
+            message = "Seats freed up while you joined the waitlist."
+        return {"success": False, "waitlisted": True, "message": message, "waitlist": entry}, 202
+
+    def _promote_waitlist(self, date):
+        """Reserve freed seats for the customers waiting on a date"""
+        waitlist = self.waitlists.get(date)
+        if waitlist is None or not waitlist.waiting:
+            return []
+        promoted = waitlist.promote(
+            lambda entry: self._hold(entry["name"], date, None, None, entry["quantity"], entry["best"],
+                                     entry["client"])
+        )
+        if self.on_promoted is not None:
+            for entry in promoted:
+                self.on_promoted(entry)
+        return promoted
+
+    def _offer_to_waitlist(self, date, seats):
+        """Promote waiting customers after ``seats`` were freed; returns those still free"""
+        # Seats handed straight to waiting customers were never free
+        taken = {
+            (seat["row"], seat["col"])
+            for entry in self._promote_waitlist(date)
+            for seat in entry["seats"]
+        }
+        return [seat for seat in seats if (seat["row"], seat["col"]) not in taken]
+
+    def waitlist_status(self, waitlist_id):
+        """A waitlist entry with its position, or its payment link once promoted"""
         with self.lock:
-            for i in range(len(self.seat_matrix)):
-                for j in range(len(self.seat_matrix[i])):
-                    if self.seat_matrix[i][j] is None:
-                        # Create payment session
-                        seat_info = {"row": i, "col": j}
-                        session_id, payment_data = payment_system.create_payment_session(
-                            seat_info, name, date
-                        )
-                        
-                        # Temporarily reserve the seat
-                        self.seat_matrix[i][j] = {
-                            "name": name, 
-                            "date": date, 
-                            "session_id": session_id,
-                            "status": "reserved"
-                        }
-                        
-                        return {
-                            "success": True,
-                            "message": f"Seat reserved at ({i},{j}) for {name}. Please complete payment.",
-                            "session_id": session_id,
-                            "payment_url": f"/payment/{session_id}",
-                            "seat": {"row": i, "col": j, "data": self.seat_matrix[i][j]}
-                        }, 200
-        
-        return {"success": False, "message": "No seats available"}, 200
+            waitlists = list(self.waitlists.values())
+        for waitlist in waitlists:
+            entry = waitlist.status(waitlist_id)
+            if entry is not None:
+                return entry, 200
+        return {"error": "Waitlist entry not found"}, 404
+
+    def leave_waitlist(self, waitlist_id):
+        """Give up a place on a waitlist"""
+        with self.lock:
+            waitlists = list(self.waitlists.values())
+        for waitlist in waitlists:
+            if waitlist.status(waitlist_id) is not None:
+                if waitlist.leave(waitlist_id):
+                    return {"success": True, "message": "Left the waitlist"}, 200
+                return {"success": False, "message": "Waitlist entry is no longer waiting"}, 409
+        return {"error": "Waitlist entry not found"}, 404
+
+    def _reserve(self, name, date, row, col, quantity, best):
+        inventory = self._inventory(date)
+        if quantity > 1:
+            if best:
+                return inventory.reserve_best_block(name, quantity)
+            return inventory.reserve_block(name, quantity)
+
+        if row is not None or col is not None:
+            if not all(isinstance(v, int) and not isinstance(v, bool) for v in (row, col)):
+                return {"error": "Both row and col must be integers"}, 400
+            return inventory.reserve_at(name, row, col)
+
+        if best:
+            return inventory.reserve_best(name)
+        return inventory.reserve(name)
 
     def confirm_booking(self, session_id):
         """Confirm booking after successful payment"""
-        with self.lock:
-            # Find the seat with this session ID
-            for i in range(len(self.seat_matrix)):
-                for j in range(len(self.seat_matrix[i])):
-                    seat = self.seat_matrix[i][j]
-                    if seat and seat.get('session_id') == session_id:
-                        # Check if payment is completed
-                        payment_success, payment_data = payment_system.check_payment_status(session_id)
-                        
-                        if payment_success:
-                            # Mark seat as confirmed
-                            seat['status'] = 'confirmed'
-                            seat['payment_method'] = payment_data.get('payment_method', 'unknown')
-                            seat['payment_completed_at'] = payment_data.get('completed_at')
-                            
-                            return {
-                                "success": True,
-                                "message": f"Booking confirmed for seat at ({i},{j})",
-                                "seat": {"row": i, "col": j, "data": seat}
-                            }, 200
-                        else:
-                            return {
-                                "success": False,
-                                "message": "Payment not completed"
-                            }, 400
-            
+        inventory = self._session_inventory(session_id)
+        if inventory is None:
             return {
                 "success": False,
                 "message": "Session not found"
             }, 404
+        result, status_code = inventory.confirm(session_id)
+        if result.get("success"):
+            self.customers.confirm(session_id)
+        return result, status_code
+
+    def release_seat(self, date, row, col):
+        """Release a held seat back to the pool"""
+        inventory = self.inventories.get(date)
+        if inventory is None:
+            return {"success": False, "message": "Seat is not reserved"}, 404
+        result, status_code = inventory.release_seat(row, col)
+        if result.get("success"):
+            if result.get("session_id"):
+                self.customers.drop_seat(result["session_id"], row, col)
+            self._promote_waitlist(date)
+        return result, status_code
+
+    def release_session(self, session_id):
+        """Release the seat held by a payment session"""
+        inventory = self._session_inventory(session_id)
+        if inventory is None:
+            return {"success": False, "message": "Session not found"}, 404
+        result, status_code = inventory.release_session(session_id)
+        if result.get("success"):
+            self.customers.drop_session(session_id)
+            self._promote_waitlist(inventory.date)
+        return result, status_code
+
+    def cancel_hold(self, session_id, cancel_token):
+        """Give the seats of an unpaid hold back straight away
+
+        ``cancel_token`` must be the one handed out with the hold. The
+        payment session is cancelled first, so a payment racing the
+        cancellation either wins (and the hold stays) or is refused. The
+        freed seats come back under ``"seats"``, leaving out any handed
+        straight to the waitlist.
+        """
+        if not payment_system.check_cancel_token(session_id, cancel_token):
+            return {"success": False, "message": "Invalid cancel token"}, 403
+        inventory = self._session_inventory(session_id)
+        if inventory is None:
+            return {"success": False, "message": "Session not found"}, 404
+        positions = inventory.session_seats.get(session_id, ())
+        if not payment_system.cancel_payment_session(session_id):
+            return {"success": False, "message": "Only unpaid holds can be cancelled"}, 409
+        result, status_code = inventory.release_session(session_id)
+        if not result.get("success"):
+            return result, status_code
+        self.customers.drop_session(session_id)
+        seats = [{"row": r, "col": c, "data": None} for r, c in positions]
+        return dict(result, date=inventory.date, seats=self._offer_to_waitlist(inventory.date, seats)), status_code
+
+    def set_price_tiers(self, price_tiers):
+        """Switch every show date to new price tiers; holds keep their quoted prices"""
+        try:
+            table = PriceTable.from_config(self.rows, self.cols, price_tiers)
+        except (KeyError, TypeError, ValueError) as e:
+            return {"error": f"Invalid price tiers: {e}"}, 400
+        self.pricing.swap(table)
+        return self.prices(), 200
+
+    def prices(self):
+        """Current price tiers with seats sold and takings per tier"""
+        # Tiers dropped by a price change still show up under revenue
+        return dict(self.pricing.table.as_dict(), revenue=payment_system.revenue_by_tier())
+
+    def customer_bookings(self, name):
+        """A customer's current holds and bookings, from the index"""
+        return {
+            "name": name,
+            "held_seats": self.customers.held(name),
+            "max_held_seats": self.customers.max_holds,
+            "bookings": self.customers.bookings(name)
+        }
+
+    def expire_holds(self, session_ids):
+        """Release holds whose payment session ran out unpaid
 
-    def book(self, name, date):
+        Returns ``{date: [released seats]}`` for the sessions that were
+        still unpaid; paid, released or unknown sessions are skipped. The
+        freed seats are first offered to the date's waitlist, and those
+        taken from it are left out.
+        """
+        by_inventory = {}
+        for session_id in session_ids:
+            if not payment_system.expire_session(session_id):
+                continue
+            self.customers.drop_session(session_id)
+            inventory = self._session_inventory(session_id)
+            if inventory is not None:
+                by_inventory.setdefault(inventory, []).append(session_id)
+
+        released = {}
+        for inventory, inventory_sessions in by_inventory.items():
+            seats = inventory.expire_sessions(inventory_sessions)
+            seats = self._offer_to_waitlist(inventory.date, seats)
+            if seats:
+                released[inventory.date] = seats
+        return released
+
+    def book(self, name, date, row=None, col=None, quantity=1, best=False, client=None):
         """Legacy booking method - now redirects to reservation"""
-        return self.reserve_seat(name, date)
+        return self.reserve_seat(name, date, row, col, quantity, best, client)
+
+    def show(self, date=None):
+        """Return current seat matrix for a date (defaults to today)"""
+        inventory = self._shown_inventory(date)
+        return self._empty_rows if inventory is None else inventory.show()
+
+    def snapshot(self, date=None):
+        """Return ``(version, seat matrix)`` for a date (defaults to today)"""
+        inventory = self._shown_inventory(date)
+        return (0, self._empty_rows) if inventory is None else inventory.snapshot
+
+    def show_since(self, since, date=None):
+        """Seat changes after version ``since``, or the full matrix if the
+        change log no longer covers it"""
+        inventory = self._shown_inventory(date)
+        if inventory is None:
+            if since == 0:
+                return {"version": 0, "full": False, "changes": []}
+            return {"version": 0, "full": True, "seats": self._empty_rows}
+        version, changes = inventory.changes_since(since)
+        if changes is None:
+            version, rows = inventory.snapshot
+            return {"version": version, "full": True, "seats": rows}
+        return {"version": version, "full": False, "changes": changes}
 
-    def show(self):
-        """Return current seat matrix"""
-        with self.lock:
-            # Return a deep copy to prevent external modification
-            return [row[:] for row in self.seat_matrix]
-    
     def reset(self):
-        """Reset all seats to empty"""
+        """Reset all seats to empty and serve the waitlists from the empty venue"""
         with self.lock:
-            # Keep consistent dimensions: 10x5
-            self.seat_matrix = [[None] * 5 for _ in range(10)]
+            inventories = list(self.inventories.values())
+        for inventory in inventories:
+            inventory.reset()
+        payment_system.reset()
+        # A hold placed between the two resets is on a seat from after the
+        # first but a session from before the second, which is now gone.
+        # Holds attached from here on are refused (see _attach_payment).
+        for inventory in inventories:
+            inventory.release_orphaned_sessions()
+        self.customers.clear()
+        for inventory in inventories:
+            self._promote_waitlist(inventory.date)
         return {"message": "All seats have been reset."}, 200
 
-    def get_available_count(self):
-        """Get count of available seats"""
-        with self.lock:
-            count = 0
-            for row in self.seat_matrix:
-                for seat in row:
-                    if seat is None:
-                        count += 1
-            return count
+    def get_available_count(self, date=None):
+        """Get count of available seats for a date (defaults to today)"""
+        inventory = self._shown_inventory(date)
+        return self.capacity if inventory is None else inventory.get_available_count()
 
-    def get_booked_count(self):
-        """Get count of booked seats"""
-        with self.lock:
-            count = 0
-            for row in self.seat_matrix:
-                for seat in row:
-                    if seat is not None:
-                        count += 1
-            return count
\ No newline at end of file
+    def get_booked_count(self, date=None):
+        """Get count of booked seats for a date (defaults to today)"""
+        inventory = self._shown_inventory(date)
+        return 0 if inventory is None else inventory.get_booked_count()
+
+    def stats(self, date=None):
+        """Occupancy counters for a date (defaults to today)"""
+        inventory = self._shown_inventory(date)
+        if inventory is not None:
+            return inventory.stats()
+        # Nothing sold yet: every section is empty
+        stats = OccupancyCounters(self.capacity).as_dict()
+        stats["date"] = date or calendar_date.today().isoformat()
+        stats["sections"] = [
+            dict(OccupancyCounters((last - first) * self.cols).as_dict(), first_row=first, last_row=last - 1)
+            for first, last in (
+                (first, min(first + self.section_rows, self.rows))
+                for first in range(0, self.rows, self.section_rows)
+            )
+        ]
+        return stats
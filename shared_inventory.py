@@ -0,0 +1,463 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from array import array
+from datetime import datetime
+
+from seat import (
+    FREE, HELD, RESERVED, CONFIRMED, STATUS_NAMES, PAYMENT_METHODS, DEFAULT_ROWS, DEFAULT_COLS,
+    DEFAULT_SECTION_ROWS, OccupancyCounters, SeatScores, SeatSection, SeatInventory, is_show_date,
+)
+
+# File header: magic, layout version, rows, cols, section_rows
+HEADER = struct.Struct('<4sIIII')
+HEADER_SIZE = 64
+MAGIC = b'SEAT'
+LAYOUT_VERSION = 1
+
+# Per-section table entry: available, reserved, confirmed, change sequence
+SECTION_FIELDS = 4
+SECTION_ENTRY_SIZE = 8 * SECTION_FIELDS
+
+# Fixed widths of the per-seat string fields
+NAME_WIDTH = 64
+SESSION_WIDTH = 36  # str(uuid4())
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+class SharedFileLayout:
+    """Byte offsets of every region in a shared seat file
+
+    After the header and the section table, each seat field is stored as a
+    fixed-width column over all seats: status byte, payment method byte,
+    claim number, payment completion time, holder name and session id. A
+    seat's record is the k-th entry of every column, so the status column
+    can be searched for free seats with one ``mmap.find``.
+    """
+
+    def __init__(self, rows, cols, section_rows):
+        seats = rows * cols
+        self.sections = (rows + section_rows - 1) // section_rows
+        self.table = HEADER_SIZE
+        self.status = _align(self.table + self.sections * SECTION_ENTRY_SIZE)
+        self.methods = self.status + seats
+        self.claims = _align(self.methods + seats)
+        self.completed_at = self.claims + 4 * seats
+        self.names = self.completed_at + 8 * seats
+        self.sessions = self.names + NAME_WIDTH * seats
+        self.size = self.sessions + SESSION_WIDTH * seats
+
+    def section_lock_offset(self, index):
+        """Byte locked with fcntl while a process works on section ``index``"""
+        return self.table + index * SECTION_ENTRY_SIZE
+
+
+class SectionLock:
+    """A section lock that excludes both threads and other processes
+
+    fcntl record locks belong to the whole process, so a thread lock is
+    taken first to keep threads of one process apart, then a lock on the
+    section's byte of the file to keep other processes out.
+    """
+
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+        self.thread_lock = threading.Lock()
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset, os.SEEK_SET)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def release(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset, os.SEEK_SET)
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SharedCounters(OccupancyCounters):
+    """Section counters stored in the section table of the shared file
+
+    Written only under the section lock, read without it like the
+    in-process counters. The fourth field counts seat changes and serves
+    as the section's share of the inventory version.
+    """
+
+    def __init__(self, fields, capacity):
+        self.capacity = capacity
+        self.lock = None
+        self.fields = fields  # memoryview of SECTION_FIELDS unsigned 64-bit ints
+
+    available = property(lambda self: self.fields[0], lambda self, value: self.fields.__setitem__(0, value))
+    reserved = property(lambda self: self.fields[1], lambda self, value: self.fields.__setitem__(1, value))
+    confirmed = property(lambda self: self.fields[2], lambda self, value: self.fields.__setitem__(2, value))
+
+    @property
+    def changes(self):
+        return self.fields[3]
+
+    def bump(self):
+        self.fields[3] += 1
+
+
+class SharedTotals(OccupancyCounters):
+    """Inventory-wide counts summed from the shared section counters"""
+
+    def __init__(self, sections, capacity):
+        self.capacity = capacity
+        self.lock = None
+        self.sections = sections
+
+    available = property(lambda self: sum(s.counters.available for s in self.sections))
+    reserved = property(lambda self: sum(s.counters.reserved for s in self.sections))
+    confirmed = property(lambda self: sum(s.counters.confirmed for s in self.sections))
+
+    def move(self, old_status, new_status):
+        pass  # the section counters already hold the change
+
+    def reset(self):
+        pass
+
+
+class SharedSeatSection(SeatSection):
+    """A section whose seat columns live in a shared memory-mapped file
+
+    Reuses the in-process section logic over memoryviews of the file.
+    Holder names and session ids are fixed-width fields instead of
+    interned ids, and free seats are found by searching the status column
+    rather than through per-process heaps and run trees, since another
+    process may change any seat at any time.
+    """
+
+    def __init__(self, inventory_file, index, first_row, last_row, cols, scores):
+        self.first_row = first_row
+        self.last_row = last_row  # exclusive
+        self.cols = cols
+        self.offset = first_row * cols
+        self.size = (last_row - first_row) * cols
+        self.scores = scores
+        self.totals = None
+        self.on_change = None
+
+        mm, layout = inventory_file.mm, inventory_file.layout
+        self.mm = mm
+        self.status_start = layout.status + self.offset
+        self.lock = SectionLock(inventory_file.fd, layout.section_lock_offset(index))
+        table = layout.table + index * SECTION_ENTRY_SIZE
+        self.counters = SharedCounters(inventory_file.view[table:table + SECTION_ENTRY_SIZE].cast('Q'),
+                                       self.size)
+
+        begin, end = self.offset, self.offset + self.size
+        view = inventory_file.view
+        self.status = view[layout.status + begin:layout.status + end]
+        self.methods = view[layout.methods + begin:layout.methods + end]
+        self.claims = view[layout.claims + 4 * begin:layout.claims + 4 * end].cast('I')
+        self.completed_at = view[layout.completed_at + 8 * begin:layout.completed_at + 8 * end].cast('d')
+        self.names = view[layout.names + NAME_WIDTH * begin:layout.names + NAME_WIDTH * end]
+        self.sessions = view[layout.sessions + SESSION_WIDTH * begin:layout.sessions + SESSION_WIDTH * end]
+
+        # Best score seen by this process; may be beaten by a seat another
+        # process freed since, which only costs best-available a little
+        self.best_score = scores.block_bound(first_row, 1)
+
+    def _changed(self, row, col):
+        self.counters.bump()
+
+    @property
+    def available(self):
+        # Resets clear the file at once, so there is no epoch to catch up on
+        return self.counters.available
+
+    def occupancy(self):
+        return self.counters.as_dict()
+
+    def reset(self):
+        """Empty every seat in the section (caller holds the lock)
+
+        Claim numbers are kept, so a hold placed before the reset by any
+        process can never match a hold placed after it.
+        """
+        size = self.size
+        self.status[:] = bytes(size)
+        self.methods[:] = bytes(size)
+        self.completed_at[:] = array('d', bytes(8 * size))
+        self.names[:] = bytes(NAME_WIDTH * size)
+        self.sessions[:] = bytes(SESSION_WIDTH * size)
+        self.counters.available = size
+        self.counters.reserved = 0
+        self.counters.confirmed = 0
+        self.counters.bump()
+        self.best_score = self.scores.block_bound(self.first_row, 1)
+
+    def _put(self, column, width, k, value):
+        raw = value.encode('utf-8')[:width] if value else b''
+        column[k * width:(k + 1) * width] = raw.ljust(width, b'\0')
+
+    def _get(self, column, width, k):
+        raw = bytes(column[k * width:(k + 1) * width]).rstrip(b'\0')
+        return raw.decode('utf-8', 'ignore') if raw else None
+
+    def pop_free_seat(self):
+        """Lowest free seat in the section, or None if it is full"""
+        found = self.mm.find(b'\0', self.status_start, self.status_start + self.size)
+        if found < 0:
+            return None
+        return divmod(self.offset + found - self.status_start, self.cols)
+
+    def push_free_seat(self, row, col):
+        pass  # free seats are found from the status column
+
+    def best_hint(self):
+        return self.best_score
+
+    def pop_best_seat(self, limit=float('inf')):
+        """Best-scoring free seat if it scores no worse than ``limit``"""
+        scores = self.scores.scores
+        best, best_seat = float('inf'), None
+        for k, status in enumerate(self.status):
+            if status == FREE and scores[self.offset + k] < best:
+                best, best_seat = scores[self.offset + k], self.offset + k
+        self.best_score = best
+        if best_seat is None or best > limit:
+            return None
+        return divmod(best_seat, self.cols)
+
+    def _has_run(self, offset, count):
+        start = self.status_start + offset * self.cols
+        return self.mm.find(bytes(count), start, start + self.cols) >= 0
+
+    def find_block(self, count):
+        """Leftmost run of ``count`` adjacent free seats as (row, col), or None"""
+        free = bytes(count)
+        for offset in range(self.last_row - self.first_row):
+            start = self.status_start + offset * self.cols
+            found = self.mm.find(free, start, start + self.cols)
+            if found >= 0:
+                return self.first_row + offset, found - start
+        return None
+
+    def hold(self, row, col, name):
+        """Mark a seat as provisionally held and return its claim number"""
+        k = self._index(row, col)
+        self._move(k, HELD)
+        self._put(self.names, NAME_WIDTH, k, name)
+        self.claims[k] = (self.claims[k] + 1) & 0xFFFFFFFF
+        self._changed(row, col)
+        return self.claims[k]
+
+    def reserve(self, row, col, session_id):
+        """Attach a payment session to a held seat"""
+        k = self._index(row, col)
+        self._move(k, RESERVED)
+        self._put(self.sessions, SESSION_WIDTH, k, session_id)
+        self._changed(row, col)
+
+    def session_of(self, row, col):
+        return self._get(self.sessions, SESSION_WIDTH, self._index(row, col))
+
+    def clear(self, row, col):
+        """Empty a seat"""
+        k = self._index(row, col)
+        self._move(k, FREE)
+        self._put(self.names, NAME_WIDTH, k, None)
+        self._put(self.sessions, SESSION_WIDTH, k, None)
+        self.methods[k] = 0
+        self.completed_at[k] = 0.0
+        self._changed(row, col)
+
+    def seat(self, row, col, date):
+        """Materialize one seat in the JSON shape served to clients"""
+        k = self._index(row, col)
+        status = self.status[k]
+        if status == FREE:
+            return None
+        seat = {
+            "name": self._get(self.names, NAME_WIDTH, k),
+            "date": date,
+            "session_id": self._get(self.sessions, SESSION_WIDTH, k),
+            "status": STATUS_NAMES[status]
+        }
+        if status == CONFIRMED:
+            seat["payment_method"] = PAYMENT_METHODS[self.methods[k]]
+            seat["payment_completed_at"] = (
+                datetime.fromtimestamp(self.completed_at[k]) if self.completed_at[k] else None
+            )
+        return seat
+
+
+class SharedSeatFile:
+    """A memory-mapped seat file, created and sized on first open
+
+    The file is laid out by ``SharedFileLayout``. Creation happens under a
+    lock on the header so concurrent workers starting together agree on
+    one file; opening an existing file checks it has the same dimensions.
+    """
+
+    def __init__(self, path, rows, cols, section_rows):
+        self.path = path
+        self.layout = SharedFileLayout(rows, cols, section_rows)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, 0, os.SEEK_SET)
+            try:
+                self._prepare(rows, cols, section_rows)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, 0, os.SEEK_SET)
+            self.mm = mmap.mmap(self.fd, self.layout.size)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.view = memoryview(self.mm)
+
+    def _prepare(self, rows, cols, section_rows):
+        """Create the file if it is empty, otherwise check its header"""
+        if os.fstat(self.fd).st_size:
+            magic, version, *dimensions = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+            if magic != MAGIC or version != LAYOUT_VERSION:
+                raise ValueError(f"{self.path} is not a seat file")
+            if dimensions != [rows, cols, section_rows]:
+                raise ValueError(f"{self.path} holds a {dimensions[0]}x{dimensions[1]} venue "
+                                 f"striped by {dimensions[2]} rows, not {rows}x{cols} by {section_rows}")
+            return
+
+        os.ftruncate(self.fd, self.layout.size)
+        # Every seat starts free, so each section starts fully available
+        table = array('Q')
+        for first in range(0, rows, section_rows):
+            table.extend(((min(first + section_rows, rows) - first) * cols, 0, 0, 0))
+        os.pwrite(self.fd, table.tobytes(), self.layout.table)
+        os.pwrite(self.fd, HEADER.pack(MAGIC, LAYOUT_VERSION, rows, cols, section_rows), 0)
+        os.fsync(self.fd)
+
+    def close(self):
+        self.view.release()
+        self.mm.close()
+        os.close(self.fd)
+
+
+class SharedSeatInventory(SeatInventory):
+    """Seat inventory shared by every process that maps the same file
+
+    Seat state and section counters live in a ``SharedSeatFile`` and each
+    section lock is also an fcntl lock on the file, so several worker
+    processes can serve reservations against one consistent seat map.
+    Claim numbers persist across resets, so a provisional hold can always
+    tell whether some other process took its seat in the meantime.
+
+    The session index and payment sessions stay per process; a session's
+    seats are re-checked against the file under the lock before use. That
+    means a hold can only be paid, cancelled or expired by the process that
+    placed it, so the booking server must run as a single worker (see
+    ``storage.lock_storage``); other processes may still read the seat
+    maps. Seat maps are read straight from the file, so there is no change
+    log and pollers asking for a delta always get the full map.
+    """
+
+    def __init__(self, path, date, rows=DEFAULT_ROWS, cols=DEFAULT_COLS,
+                 section_rows=DEFAULT_SECTION_ROWS, on_hold=None):
+        self.date = date
+        self.on_hold = on_hold
+        self.rows = rows
+        self.cols = cols
+        self.section_rows = section_rows
+        self.file = SharedSeatFile(path, rows, cols, section_rows)
+        self.scores = SeatScores(rows, cols)
+        self.sections = [
+            SharedSeatSection(self.file, index, first, min(first + section_rows, rows), cols, self.scores)
+            for index, first in enumerate(range(0, rows, section_rows))
+        ]
+        self.totals = SharedTotals(self.sections, rows * cols)
+        self._reset_session_index()
+        self.journal = None  # the file itself is the durable copy
+        self.pricing = None
+
+    @property
+    def version(self):
+        return sum(section.counters.changes for section in self.sections)
+
+    @property
+    def snapshot(self):
+        version = self.version
+        return version, self.show()
+
+    def _seat_changed(self, section, row, col):
+        pass  # readers go to the file
+
+    def _locked_session(self, session_id):
+        section, positions = super()._locked_session(session_id)
+        if section is None:
+            return None, None
+        # Another process may have released or reset these seats
+        positions = tuple(p for p in positions if section.session_of(*p) == session_id)
+        if not positions:
+            self.session_seats.pop(session_id, None)
+            section.lock.release()
+            return None, None
+        return section, positions
+
+    def show(self):
+        """Return the current seat matrix read from the file"""
+        rows = []
+        for section in self.sections:
+            for row in range(section.first_row, section.last_row):
+                rows.append(tuple(section.seat(row, col, self.date) for col in range(self.cols)))
+        return tuple(rows)
+
+    def changes_since(self, since):
+        version = self.version
+        return version, ([] if since == version else None)
+
+    def reset(self):
+        """Empty every seat in the venue, for every process"""
+        with self._all_sections():
+            for section in self.sections:
+                section.reset()
+            self._reset_session_index()
+
+    def close(self):
+        self.file.close()
+
+
+def shared_inventory_factory(directory):
+    """Inventory factory for ``TicketBooking`` keeping one seat file per date in ``directory``"""
+    os.makedirs(directory, exist_ok=True)
+
+    def seat_file(date):
+        # The date names the file, so anything but YYYY-MM-DD could reach
+        # outside the directory
+        if not is_show_date(date):
+            raise ValueError(f"Invalid show date {date!r}")
+        return os.path.join(directory, f"{date}.seats")
+
+    def factory(date, rows, cols, section_rows, on_hold=None):
+        return SharedSeatInventory(seat_file(date), date, rows, cols, section_rows, on_hold)
+
+    def has_date(date):
+        """Whether any process has created the seat file for ``date`` yet"""
+        return is_show_date(date) and os.path.exists(seat_file(date))
+
+    def dates():
+        """Every show date with a seat file"""
+        return sorted(
+            name[:-len(".seats")] for name in os.listdir(directory)
+            if name.endswith(".seats") and is_show_date(name[:-len(".seats")])
+        )
+
+    factory.has_date = has_date
+    factory.dates = dates
+    return factory
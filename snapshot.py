@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+from itertools import accumulate
+from pricing import DEFAULT_PRICE, DEFAULT_TIER
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SEATSNAP'
+FORMAT_VERSION = 4  # 2 added payment session epochs, 3 seat prices, 4 the payment epoch
+COUNT = struct.Struct('<I')
+DIMENSIONS = struct.Struct('<III')
+NO_STRING = 0xFFFFFFFF
+
+PAYMENT_STATUSES = ('pending', 'completed', 'expired')
+PAYMENT_METHODS = (None, 'card', 'paypal', 'wallet')
+
+
+def _write_blob(out, data):
+    out.write(COUNT.pack(len(data)))
+    out.write(data)
+
+
+def _write_strings(out, strings):
+    """A string table: one length per entry (NO_STRING for None), then the UTF-8 bytes"""
+    encoded = [None if s is None else s.encode('utf-8') for s in strings]
+    lengths = array('I', (NO_STRING if e is None else len(e) for e in encoded))
+    out.write(COUNT.pack(len(lengths)))
+    _write_blob(out, lengths.tobytes())
+    _write_blob(out, b''.join(e for e in encoded if e is not None))
+
+
+def _write_floats(out, values):
+    _write_blob(out, array('d', values).tobytes())
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def count(self):
+        value, = COUNT.unpack_from(self.data, self.pos)
+        self.pos += COUNT.size
+        return value
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.data, self.pos)
+        self.pos += layout.size
+        return values
+
+    def blob(self):
+        size = self.count()
+        data = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return bytes(data)
+
+    def strings(self):
+        self.count()
+        lengths = array('I', self.blob())
+        blob = self.blob()
+        text = blob.decode('utf-8')
+        if len(text) == len(blob):
+            # ASCII, so byte lengths are character offsets: decode once and slice
+            ends = accumulate(0 if length == NO_STRING else length for length in lengths)
+            return [None if length == NO_STRING else text[end - length:end]
+                    for length, end in zip(lengths, ends)]
+        strings, start = [], 0
+        for length in lengths:
+            if length == NO_STRING:
+                strings.append(None)
+            else:
+                strings.append(blob[start:start + length].decode('utf-8'))
+                start += length
+        return strings
+
+    def floats(self):
+        return array('d', self.blob())
+
+
+def write_snapshot(path, inventories, sessions, epoch=0):
+    """Atomically write a snapshot file
+
+    ``inventories`` holds ``(date, rows, cols, section_rows, columns)``
+    with ``columns`` as returned by ``SeatInventory.capture()``, and
+    ``sessions`` and ``epoch`` the payment sessions and reset generation
+    from ``Payment.capture()``.
+    Seat state is stored as the raw status, method, time and string-id
+    columns with their string tables, and payment sessions as parallel
+    columns, so loading is mostly bulk copies rather than parsing.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(MAGIC)
+        out.write(COUNT.pack(FORMAT_VERSION))
+        # Sessions alone can't give it back: a reset leaves none behind
+        out.write(COUNT.pack(epoch))
+
+        out.write(COUNT.pack(len(inventories)))
+        for date, rows, cols, section_rows, columns in inventories:
+            _write_strings(out, [date])
+            out.write(DIMENSIONS.pack(rows, cols, section_rows))
+            for status, methods, completed_at, holders, holder_strings, seat_sessions, session_strings in columns:
+                _write_blob(out, status)
+                _write_blob(out, methods)
+                _write_blob(out, completed_at)
+                _write_blob(out, holders)
+                _write_strings(out, holder_strings)
+                _write_blob(out, seat_sessions)
+                _write_strings(out, session_strings)
+
+        _write_strings(out, [s['session_id'] for s in sessions])
+        _write_strings(out, [s['user_name'] for s in sessions])
+        _write_strings(out, [s['date'] for s in sessions])
+        # seat_info is a tiny dict per session, kept as compact JSON
+        _write_strings(out, [json.dumps(s['seat_info'], separators=(',', ':')) for s in sessions])
+        _write_strings(out, [json.dumps(s['seat_prices'], separators=(',', ':')) for s in sessions])
+        _write_blob(out, bytes(PAYMENT_STATUSES.index(s['status']) for s in sessions))
+        _write_blob(out, bytes(1 if s.get('archived') else 0 for s in sessions))
+        _write_blob(out, bytes(PAYMENT_METHODS.index(s.get('payment_method')) for s in sessions))
+        _write_blob(out, array('I', (s['quantity'] for s in sessions)).tobytes())
+        _write_blob(out, array('I', (s.get('epoch', 0) for s in sessions)).tobytes())
+        _write_floats(out, (s['amount'] for s in sessions))
+        _write_floats(out, (s['created_at'].timestamp() for s in sessions))
+        _write_floats(out, (s['expires_at'].timestamp() for s in sessions))
+        _write_floats(out, (s['completed_at'].timestamp() if s.get('completed_at') else 0.0
+                            for s in sessions))
+
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def read_snapshot(path):
+    """Read a snapshot file back into ``(inventories, sessions, epoch)``
+
+    The shapes match what ``write_snapshot`` was given, so the results
+    feed straight into ``SeatInventory.load()`` and ``Payment.load()``.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a booking snapshot")
+    reader = _Reader(data)
+    reader.pos = len(MAGIC)
+    version = reader.count()
+    if not 1 <= version <= FORMAT_VERSION:
+        raise ValueError(f"{path} has an unsupported snapshot version")
+    epoch = reader.count() if version >= 4 else None
+
+    inventories = []
+    for _ in range(reader.count()):
+        date, = reader.strings()
+        rows, cols, section_rows = reader.unpack(DIMENSIONS)
+        columns = []
+        for _ in range(0, rows, section_rows):
+            columns.append((
+                reader.blob(), reader.blob(), reader.blob(),
+                reader.blob(), reader.strings(),
+                reader.blob(), reader.strings(),
+            ))
+        inventories.append((date, rows, cols, section_rows, columns))
+
+    session_ids = reader.strings()
+    user_names = reader.strings()
+    dates = reader.strings()
+    seat_infos = reader.strings()
+    seat_prices = reader.strings() if version >= 3 else None
+    statuses = reader.blob()
+    archived = reader.blob()
+    methods = reader.blob()
+    quantities = array('I', reader.blob())
+    epochs = array('I', reader.blob()) if version >= 2 else array('I', bytes(4 * len(session_ids)))
+    amounts = reader.floats()
+    created = reader.floats()
+    expires = reader.floats()
+    completed = reader.floats()
+
+    # One parse of a JSON array instead of a json.loads call per session
+    seat_infos = json.loads('[' + ','.join(seat_infos) + ']')
+    seat_prices = json.loads('[' + ','.join(seat_prices) + ']') if seat_prices is not None else None
+
+    sessions = []
+    for k, session_id in enumerate(session_ids):
+        session = {
+            'session_id': session_id,
+            'seat_info': seat_infos[k],
+            'user_name': user_names[k],
+            'date': dates[k],
+            'quantity': quantities[k],
+            'seat_prices': (seat_prices[k] if seat_prices is not None
+                            else [[DEFAULT_TIER, DEFAULT_PRICE]] * quantities[k]),
+            'amount': amounts[k],
+            'created_at': datetime.fromtimestamp(created[k]),
+            'expires_at': datetime.fromtimestamp(expires[k]),
+            'status': PAYMENT_STATUSES[statuses[k]],
+            'epoch': epochs[k]
+        }
+        if PAYMENT_METHODS[methods[k]] is not None:
+            session['payment_method'] = PAYMENT_METHODS[methods[k]]
+        if completed[k]:
+            session['completed_at'] = datetime.fromtimestamp(completed[k])
+        if archived[k]:
+            session['archived'] = True
+        sessions.append(session)
+    if epoch is None:
+        # Older snapshots only kept the epoch of each session
+        epoch = max(epochs, default=0)
+    return inventories, sessions, epoch
+
+
+class Snapshotter:
+    """Periodically snapshots booking state and truncates the journal
+
+    Each snapshot first rotates the journal, so every record older than
+    the snapshot sits in the previous log segment. State is then copied one
+    section at a time under that section's lock (a few memory copies) and
+    serialized in this background thread. Once the snapshot file is in
+    place the previous segment is deleted. Replaying the journal on top is
+    idempotent, so changes that land while sections are being copied are
+    simply applied again on recovery.
+    """
+
+    def __init__(self, booking, payments, journal, path, interval=60):
+        self.booking = booking
+        self.payments = payments
+        self.journal = journal
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def take(self):
+        """Write one snapshot now and drop the journal it makes redundant"""
+        started = time.monotonic()
+        self.journal.rotate()
+        inventories = self.booking.capture()
+        epoch, sessions = self.payments.capture()
+        write_snapshot(self.path, inventories, sessions, epoch)
+        self.journal.discard_previous()
+        logger.info(f"Snapshot of {len(inventories)} show dates and {len(sessions)} payment sessions "
+                    f"written in {time.monotonic() - started:.3f}s")
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="snapshotter", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.take()
+            except Exception:
+                logger.exception("Failed to write a booking snapshot")
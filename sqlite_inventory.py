@@ -0,0 +1,601 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from payment import payment_system
+from seat import (
+    FREE, HELD, RESERVED, CONFIRMED, STATUS_NAMES, DEFAULT_ROWS, DEFAULT_COLS, DEFAULT_SECTION_ROWS,
+    SeatScores,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS venues (
+    date TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    cols INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS seats (
+    date TEXT NOT NULL,
+    seat_row INTEGER NOT NULL,
+    seat_col INTEGER NOT NULL,
+    status INTEGER NOT NULL DEFAULT 0,
+    score REAL NOT NULL,
+    name TEXT,
+    session_id TEXT,
+    claim INTEGER NOT NULL DEFAULT 0,
+    payment_method TEXT,
+    completed_at REAL,
+    PRIMARY KEY (date, seat_row, seat_col)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seats_by_status ON seats (date, status, seat_row, seat_col);
+CREATE INDEX IF NOT EXISTS seats_by_score ON seats (date, status, score);
+CREATE INDEX IF NOT EXISTS seats_by_session ON seats (session_id);
+"""
+
+CLEARED = "status = 0, name = NULL, session_id = NULL, payment_method = NULL, completed_at = NULL"
+
+# Connections kept open per database file
+DEFAULT_POOL_SIZE = 8
+
+
+class _SeatTaken(Exception):
+    """A conditional claim found the seat already taken; rolls the transaction back"""
+
+
+class ConnectionPool:
+    """Up to ``size`` connections to one database, reused across threads
+
+    The threaded dev server runs every request on a new thread, so a
+    connection per thread meant a new connection (and its PRAGMAs) per
+    request. Connections are opened on demand until there are ``size`` of
+    them; after that a thread waits for one to be handed back.
+    """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()  # most recently used first
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        return db
+
+    def _take(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            grow = self.opened < self.size
+            if grow:
+                self.opened += 1
+        if not grow:
+            return self.idle.get()
+        try:
+            return self._open()
+        except BaseException:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the block"""
+        db = self._take()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            self.idle.put(db)
+
+
+class SQLiteSeatInventory:
+    """Seat inventory for one show date stored in a SQLite database
+
+    Every seat is a row, claimed with a conditional ``UPDATE ... WHERE
+    status = FREE`` so concurrent requests, threads or processes can never
+    both win it. The database runs in WAL mode so readers never block the
+    writer, and connections come from a pool shared by every date in the
+    same file. Write transactions
+    start with ``BEGIN IMMEDIATE`` so writers queue on SQLite's lock
+    instead of failing mid-transaction.
+
+    Provides the same methods and responses as ``SeatInventory``. Seat
+    maps are read from the database, so delta polling always gets the
+    full map.
+    """
+
+    def __init__(self, path, date, rows=DEFAULT_ROWS, cols=DEFAULT_COLS,
+                 section_rows=DEFAULT_SECTION_ROWS, on_hold=None, pool=None):
+        self.path = path
+        self.date = date
+        self.rows = rows
+        self.cols = cols
+        self.section_rows = section_rows
+        self.on_hold = on_hold
+        self.journal = None  # the database is the durable copy
+        self.pricing = None
+        self.scores = SeatScores(rows, cols)
+        self.pool = pool or ConnectionPool(path)
+
+        with self.pool.connection() as db:
+            db.executescript(SCHEMA)
+        with self._transaction() as db:
+            venue = db.execute("SELECT rows, cols FROM venues WHERE date = ?", (date,)).fetchone()
+            if venue is None:
+                db.execute("INSERT INTO venues (date, rows, cols) VALUES (?, ?, ?)", (date, rows, cols))
+                db.executemany(
+                    "INSERT INTO seats (date, seat_row, seat_col, score) VALUES (?, ?, ?, ?)",
+                    ((date, r, c, self.scores.scores[r * cols + c]) for r in range(rows) for c in range(cols))
+                )
+            elif tuple(venue) != (rows, cols):
+                raise ValueError(f"{path} holds a {venue[0]}x{venue[1]} venue for {date}, not {rows}x{cols}")
+
+    @contextmanager
+    def _transaction(self):
+        """A write transaction, committed unless the block raises"""
+        with self.pool.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    @contextmanager
+    def _read(self):
+        """A read transaction; WAL mode gives it a consistent view without blocking writers"""
+        with self.pool.connection() as db:
+            db.execute("BEGIN")
+            try:
+                yield db
+            finally:
+                db.execute("COMMIT")
+
+    def _changed(self, db):
+        db.execute("UPDATE venues SET version = version + 1 WHERE date = ?", (self.date,))
+
+    def _hold(self, db, positions, name):
+        """Claim free seats under one transaction and return their claim numbers"""
+        claims = []
+        for r, c in positions:
+            claimed = db.execute(
+                "UPDATE seats SET status = ?, name = ?, claim = claim + 1 "
+                "WHERE date = ? AND seat_row = ? AND seat_col = ? AND status = ? RETURNING claim",
+                (HELD, name, self.date, r, c, FREE)
+            ).fetchone()
+            if claimed is None:
+                raise _SeatTaken()
+            claims.append(claimed[0])
+        self._changed(db)
+        return claims
+
+    def _claim_first(self, db, name, order):
+        """Hold the first free seat in ``order`` with a single conditional UPDATE
+
+        Picking and claiming the seat is one statement, so there is no gap
+        between finding a free seat and taking it. Returns
+        ``(position, claim)``, or None when no seat is free.
+        """
+        claimed = db.execute(
+            "UPDATE seats SET status = ?, name = ?, claim = claim + 1 "
+            "WHERE date = ? AND status = ? AND (seat_row, seat_col) = ("
+            "SELECT seat_row, seat_col FROM seats WHERE date = ? AND status = ? "
+            f"ORDER BY {order} LIMIT 1) RETURNING seat_row, seat_col, claim",
+            (HELD, name, self.date, FREE, self.date, FREE)
+        ).fetchone()
+        if claimed is None:
+            return None
+        self._changed(db)
+        return (claimed[0], claimed[1]), claimed[2]
+
+    def _free_seats(self, db):
+        return db.execute(
+            "SELECT seat_row, seat_col FROM seats WHERE date = ? AND status = ? ORDER BY seat_row, seat_col",
+            (self.date, FREE)
+        ).fetchall()
+
+    def _blocks(self, db, count):
+        """Every run of ``count`` adjacent free seats as (row, first_col)"""
+        run_row, run_start, run_length = None, 0, 0
+        for r, c in self._free_seats(db):
+            if r == run_row and c == run_start + run_length:
+                run_length += 1
+            else:
+                run_row, run_start, run_length = r, c, 1
+            if run_length >= count:
+                yield r, c - count + 1
+
+    def reserve(self, name):
+        """Reserve the first free seat and create payment session"""
+        with self._transaction() as db:
+            claimed = self._claim_first(db, name, "seat_row, seat_col")
+        if claimed is None:
+            return {"success": False, "message": "No seats available"}, 200
+        position, claim = claimed
+        return self._attach_payment([position], [claim], name)
+
+    def reserve_at(self, name, row, col):
+        """Claim one specific seat if it is still free (compare-and-set)"""
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return {"error": f"Seat ({row},{col}) does not exist"}, 400
+        try:
+            with self._transaction() as db:
+                claims = self._hold(db, [(row, col)], name)
+        except _SeatTaken:
+            return {"success": False, "message": f"Seat at ({row},{col}) is already taken"}, 409
+        return self._attach_payment([(row, col)], claims, name)
+
+    def reserve_block(self, name, count):
+        """Claim ``count`` adjacent seats in one row under one payment session"""
+        if not 1 <= count <= self.cols:
+            return {"error": f"Group size must be between 1 and {self.cols}"}, 400
+        with self._transaction() as db:
+            start = next(self._blocks(db, count), None)
+            if start is None:
+                return {"success": False, "message": f"No block of {count} adjacent seats available"}, 200
+            positions = [(start[0], c) for c in range(start[1], start[1] + count)]
+            claims = self._hold(db, positions, name)
+        return self._attach_payment(positions, claims, name)
+
+    def reserve_best(self, name):
+        """Reserve the best-scoring free seat in the venue"""
+        with self._transaction() as db:
+            claimed = self._claim_first(db, name, "score, seat_row, seat_col")
+        if claimed is None:
+            return {"success": False, "message": "No seats available"}, 200
+        position, claim = claimed
+        return self._attach_payment([position], [claim], name)
+
+    def reserve_best_block(self, name, count):
+        """Reserve the best-scoring block of ``count`` adjacent seats in a row"""
+        if not 1 <= count <= self.cols:
+            return {"error": f"Group size must be between 1 and {self.cols}"}, 400
+        with self._transaction() as db:
+            start = min(self._blocks(db, count), default=None,
+                        key=lambda block: self.scores.block_score(block[0], block[1], count))
+            if start is None:
+                return {"success": False, "message": f"No block of {count} adjacent seats available"}, 200
+            positions = [(start[0], c) for c in range(start[1], start[1] + count)]
+            claims = self._hold(db, positions, name)
+        return self._attach_payment(positions, claims, name)
+
+    def _attach_payment(self, positions, claims, name):
+        """Create the payment session for held seats and attach it
+
+        Runs outside any transaction so a slow payment backend never holds
+        the database lock. If a hold vanished meanwhile it is rolled back.
+        """
+        i, j = positions[0]
+        seat_info = {"row": i, "col": j}
+        if len(positions) > 1:
+            seat_info["seats"] = [{"row": r, "col": c} for r, c in positions]
+        try:
+            session_id, payment_data = payment_system.create_payment_session(
+                seat_info, name, self.date, quantity=len(positions),
+                seat_prices=self.pricing.seat_prices(positions) if self.pricing else None
+            )
+        except Exception:
+            self._drop_holds(positions, claims)
+            return {"success": False, "message": "Could not start payment, please try again"}, 503
+
+        try:
+            with self._transaction() as db:
+                for (r, c), claim in zip(positions, claims):
+                    attached = db.execute(
+                        "UPDATE seats SET status = ?, session_id = ? "
+                        "WHERE date = ? AND seat_row = ? AND seat_col = ? AND status = ? AND claim = ?",
+                        (RESERVED, session_id, self.date, r, c, HELD, claim)
+                    ).rowcount
+                    if not attached:
+                        raise _SeatTaken()
+                # Payments were reset since the session was created
+                if payment_system.get_payment_session(session_id) is None:
+                    raise _SeatTaken()
+                self._changed(db)
+                seats = self._seats(db, positions)
+        except _SeatTaken:
+            self._drop_holds(positions, claims)
+            payment_system.cancel_payment_session(session_id)
+            return {"success": False, "message": "Seat is no longer available"}, 409
+
+        if self.on_hold is not None:
+            self.on_hold(session_id, payment_data['expires_at'])
+        if len(positions) == 1:
+            message = f"Seat reserved at ({i},{j}) for {name}. Please complete payment."
+        else:
+            message = (f"{len(positions)} seats reserved in row {i} from column {j} "
+                       f"for {name}. Please complete payment.")
+        return {
+            "success": True,
+            "message": message,
+            "session_id": session_id,
+            "payment_url": f"/payment/{session_id}",
+            "seat": seats[0],
+            "seats": seats
+        }, 200
+
+    def _drop_holds(self, positions, claims):
+        """Roll back provisional holds still in place"""
+        with self._transaction() as db:
+            for (r, c), claim in zip(positions, claims):
+                db.execute(
+                    f"UPDATE seats SET {CLEARED} "
+                    "WHERE date = ? AND seat_row = ? AND seat_col = ? AND status = ? AND claim = ?",
+                    (self.date, r, c, HELD, claim)
+                )
+            self._changed(db)
+
+    def _seat(self, status, name, session_id, payment_method, completed_at):
+        """Materialize one seat in the JSON shape served to clients"""
+        if status == FREE:
+            return None
+        seat = {
+            "name": name,
+            "date": self.date,
+            "session_id": session_id,
+            "status": STATUS_NAMES[status]
+        }
+        if status == CONFIRMED:
+            seat["payment_method"] = payment_method
+            seat["payment_completed_at"] = datetime.fromtimestamp(completed_at) if completed_at else None
+        return seat
+
+    def _seats(self, db, positions):
+        seats = []
+        for r, c in positions:
+            fields = db.execute(
+                "SELECT status, name, session_id, payment_method, completed_at FROM seats "
+                "WHERE date = ? AND seat_row = ? AND seat_col = ?", (self.date, r, c)
+            ).fetchone()
+            seats.append({"row": r, "col": c, "data": self._seat(*fields)})
+        return seats
+
+    def _session_positions(self, db, session_id):
+        return [tuple(p) for p in db.execute(
+            "SELECT seat_row, seat_col FROM seats WHERE date = ? AND session_id = ? AND status != ? "
+            "ORDER BY seat_row, seat_col", (self.date, session_id, FREE)
+        )]
+
+    @property
+    def session_seats(self):
+        """session_id -> positions of every unpaid seat"""
+        sessions = {}
+        with self._read() as db:
+            for session_id, r, c in db.execute(
+                "SELECT session_id, seat_row, seat_col FROM seats WHERE date = ? AND status = ?",
+                (self.date, RESERVED)
+            ):
+                sessions.setdefault(session_id, []).append((r, c))
+        return {session_id: tuple(positions) for session_id, positions in sessions.items()}
+
+    def confirm(self, session_id):
+        """Confirm booking after successful payment"""
+        with self._transaction() as db:
+            positions = self._session_positions(db, session_id)
+            if not positions:
+                return {"success": False, "message": "Session not found"}, 404
+
+            payment_success, payment_data = payment_system.check_payment_status(session_id)
+            if not payment_success:
+                return {"success": False, "message": "Payment not completed"}, 400
+
+            completed_at = payment_data.get('completed_at')
+            db.execute(
+                "UPDATE seats SET status = ?, payment_method = ?, completed_at = ? "
+                "WHERE date = ? AND session_id = ? AND status != ?",
+                (CONFIRMED, payment_data.get('payment_method', 'unknown'),
+                 completed_at.timestamp() if completed_at else None, self.date, session_id, FREE)
+            )
+            self._changed(db)
+            seats = self._seats(db, positions)
+
+        i, j = positions[0]
+        return {
+            "success": True,
+            "message": f"Booking confirmed for seat at ({i},{j})"
+                       if len(positions) == 1 else
+                       f"Booking confirmed for {len(positions)} seats in row {i}",
+            "seat": seats[0],
+            "seats": seats
+        }, 200
+
+    def release_seat(self, row, col):
+        """Release a held seat back to the pool"""
+        with self._transaction() as db:
+            released = db.execute(
+                "SELECT session_id FROM seats WHERE date = ? AND seat_row = ? AND seat_col = ? AND status != ?",
+                (self.date, row, col, FREE)
+            ).fetchone()
+            if released is None:
+                return {"success": False, "message": "Seat is not reserved"}, 404
+            db.execute(f"UPDATE seats SET {CLEARED} WHERE date = ? AND seat_row = ? AND seat_col = ?",
+                       (self.date, row, col))
+            self._changed(db)
+        return {"success": True, "message": f"Seat at ({row},{col}) released", "session_id": released[0]}, 200
+
+    def release_session(self, session_id):
+        """Release every seat held by a payment session"""
+        with self._transaction() as db:
+            released = db.execute(
+                f"UPDATE seats SET {CLEARED} WHERE date = ? AND session_id = ? AND status != ? "
+                "RETURNING seat_row, seat_col", (self.date, session_id, FREE)
+            ).fetchall()
+            if not released:
+                return {"success": False, "message": "Session not found"}, 404
+            self._changed(db)
+        if len(released) == 1:
+            row, col = released[0]
+            return {"success": True, "message": f"Seat at ({row},{col}) released"}, 200
+        return {"success": True, "message": f"Released {len(released)} seats"}, 200
+
+    def expire_sessions(self, session_ids):
+        """Release the unpaid seats of expired sessions in one transaction"""
+        released = []
+        with self._transaction() as db:
+            for session_id in session_ids:
+                for r, c in db.execute(
+                    f"UPDATE seats SET {CLEARED} WHERE date = ? AND session_id = ? AND status IN (?, ?) "
+                    "RETURNING seat_row, seat_col", (self.date, session_id, HELD, RESERVED)
+                ).fetchall():
+                    released.append({"row": r, "col": c, "data": None})
+            if released:
+                self._changed(db)
+        return released
+
+    def release_unpaid(self):
+        """Release every held or reserved seat; returns how many were freed"""
+        with self._transaction() as db:
+            released = db.execute(f"UPDATE seats SET {CLEARED} WHERE date = ? AND status IN (?, ?)",
+                                  (self.date, HELD, RESERVED)).rowcount
+            if released:
+                self._changed(db)
+        return released
+
+    def release_orphaned_sessions(self):
+        """Release the seats of sessions the payment system no longer knows
+
+        The write transaction waits for a hold still being attached, which
+        checks its session inside its own transaction. Payment sessions
+        live in this process, so this assumes a single worker.
+        """
+        with self._transaction() as db:
+            sessions = {session_id for session_id, in db.execute(
+                "SELECT DISTINCT session_id FROM seats WHERE date = ? AND status = ?", (self.date, RESERVED)
+            )}
+            orphaned = [session_id for session_id in sessions
+                        if payment_system.get_payment_session(session_id) is None]
+            for session_id in orphaned:
+                db.execute(f"UPDATE seats SET {CLEARED} WHERE date = ? AND session_id = ? AND status = ?",
+                           (self.date, session_id, RESERVED))
+            if orphaned:
+                self._changed(db)
+
+    def _matrix(self, db):
+        rows = [[None] * self.cols for _ in range(self.rows)]
+        for r, c, *fields in db.execute(
+            "SELECT seat_row, seat_col, status, name, session_id, payment_method, completed_at "
+            "FROM seats WHERE date = ? AND status != ?", (self.date, FREE)
+        ):
+            rows[r][c] = self._seat(*fields)
+        return tuple(tuple(row) for row in rows)
+
+    def _version(self, db):
+        return db.execute("SELECT version FROM venues WHERE date = ?", (self.date,)).fetchone()[0]
+
+    @property
+    def version(self):
+        with self._read() as db:
+            return self._version(db)
+
+    @property
+    def snapshot(self):
+        with self._read() as db:
+            return self._version(db), self._matrix(db)
+
+    def show(self):
+        """Return the current seat matrix read from the database"""
+        with self._read() as db:
+            return self._matrix(db)
+
+    def changes_since(self, since):
+        version = self.version
+        return version, ([] if since == version else None)
+
+    def reset(self):
+        """Empty every seat for the date; claim numbers keep counting"""
+        with self._transaction() as db:
+            db.execute(f"UPDATE seats SET {CLEARED} WHERE date = ?", (self.date,))
+            self._changed(db)
+
+    def _counts(self, db, by_section=False):
+        counts = {}
+        group = "seat_row / ?" if by_section else "0"
+        params = ((self.section_rows,) if by_section else ()) + (self.date,)
+        for section, status, count in db.execute(
+            f"SELECT {group} AS section, status, COUNT(*) FROM seats WHERE date = ? GROUP BY section, status",
+            params
+        ):
+            section_counts = counts.setdefault(section, {"available": 0, "reserved": 0, "confirmed": 0})
+            key = "available" if status == FREE else "confirmed" if status == CONFIRMED else "reserved"
+            section_counts[key] += count
+        return counts
+
+    def get_available_count(self):
+        with self._read() as db:
+            return self._counts(db).get(0, {}).get("available", 0)
+
+    def get_booked_count(self):
+        with self._read() as db:
+            counts = self._counts(db).get(0, {})
+        return counts.get("reserved", 0) + counts.get("confirmed", 0)
+
+    def stats(self):
+        """Occupancy counters for the venue and each section"""
+        with self._read() as db:
+            totals = self._counts(db).get(0, {})
+            sections = self._counts(db, by_section=True)
+        stats = {
+            "capacity": self.rows * self.cols,
+            "available": totals.get("available", 0),
+            "reserved": totals.get("reserved", 0),
+            "confirmed": totals.get("confirmed", 0),
+            "date": self.date,
+            "sections": []
+        }
+        for index, first in enumerate(range(0, self.rows, self.section_rows)):
+            last = min(first + self.section_rows, self.rows)
+            counts = sections.get(index, {})
+            stats["sections"].append({
+                "capacity": (last - first) * self.cols,
+                "available": counts.get("available", 0),
+                "reserved": counts.get("reserved", 0),
+                "confirmed": counts.get("confirmed", 0),
+                "first_row": first,
+                "last_row": last - 1
+            })
+        return stats
+
+
+def sqlite_inventory_factory(path, pool_size=DEFAULT_POOL_SIZE):
+    """Inventory factory for ``TicketBooking`` keeping every show date in one SQLite file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    pool = ConnectionPool(path, pool_size)
+
+    def factory(date, rows, cols, section_rows, on_hold=None):
+        return SQLiteSeatInventory(path, date, rows, cols, section_rows, on_hold, pool)
+
+    def has_date(date):
+        """Whether any process has created ``date`` in the database yet"""
+        if not os.path.exists(path):
+            return False
+        with pool.connection() as db:
+            try:
+                return db.execute("SELECT 1 FROM venues WHERE date = ?", (date,)).fetchone() is not None
+            except sqlite3.OperationalError:
+                return False  # no schema yet
+
+    def dates():
+        """Every show date in the database"""
+        if not os.path.exists(path):
+            return []
+        with pool.connection() as db:
+            try:
+                return [date for date, in db.execute("SELECT date FROM venues ORDER BY date")]
+            except sqlite3.OperationalError:
+                return []
+
+    factory.has_date = has_date
+    factory.dates = dates
+    return factory
@@ -0,0 +1,62 @@
+import fcntl
+import os
+
+from seat import SeatInventory
+from shared_inventory import shared_inventory_factory
+from sqlite_inventory import sqlite_inventory_factory
+
+STORAGE_BACKENDS = ("memory", "shared", "sqlite")
+
+
+def inventory_factory(backend="memory", location=None):
+    """Inventory factory for ``TicketBooking`` by storage backend name
+
+    Every backend builds per-date inventories with the ``SeatInventory``
+    interface: ``reserve``, ``reserve_at``, ``reserve_block``,
+    ``reserve_best``, ``reserve_best_block``, ``confirm``, ``release_seat``,
+    ``release_session``, ``expire_sessions``, ``show``, ``snapshot``,
+    ``changes_since``, ``reset``, the count methods and ``stats``, all
+    returning the same ``(body, status)`` pairs. Factories of backends
+    shared between processes also have ``has_date(date)``, so read-only
+    queries can open a date another process created without creating one,
+    and ``dates()``, listing every date already stored.
+
+    - ``memory``: striped in-process inventory (``location`` unused)
+    - ``shared``: memory-mapped files in the ``location`` directory,
+      shared by every worker process mapping them
+    - ``sqlite``: one SQLite database file at ``location``
+
+    Payment sessions are kept per process whatever the backend, so only
+    one process may sell from a store; ``lock_storage`` enforces that.
+    """
+    if backend == "memory":
+        return SeatInventory
+    if not location:
+        raise ValueError(f"The {backend} storage backend needs a location")
+    if backend == "shared":
+        return shared_inventory_factory(location)
+    if backend == "sqlite":
+        return sqlite_inventory_factory(location)
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of {', '.join(STORAGE_BACKENDS)}")
+
+
+def lock_storage(backend, location):
+    """Claim the store at ``location`` for this process until it exits
+
+    A hold can only be paid, cancelled or expired by the process holding
+    its payment session, so a second booking server on the same store
+    would strand its customers' holds, and would free them all on start.
+    Raises RuntimeError if another process already serves the store.
+    Returns the open lock file, which must be kept.
+    """
+    if backend == "memory":
+        return None
+    path = os.path.join(location, "server.lock") if backend == "shared" else location + ".server.lock"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    lock_file = open(path, "ab")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError(f"The {backend} store at {location} is in use by another booking server")
+    return lock_file
@@ -0,0 +1,50 @@
+import threading
+
+from payment import payment_system
+from seat import TicketBooking
+
+DATE = '2026-06-01'
+
+
+def test_payment_racing_a_cancel_is_refused_or_keeps_the_seat():
+    booking = TicketBooking(rows=20, cols=10)
+    for _ in range(100):
+        hold, status_code = booking.book('racer', DATE)
+        assert status_code == 200
+        session_id = hold['session_id']
+        sold_before = payment_system.revenue_by_tier().get('standard', {}).get('seats', 0)
+        start = threading.Barrier(2)
+        outcome = {}
+
+        def pay():
+            start.wait()
+            outcome['paid'], _ = payment_system.process_payment(session_id)
+
+        def cancel():
+            start.wait()
+            outcome['cancelled'] = booking.cancel_hold(session_id, hold['cancel_token'])[1] == 200
+
+        threads = [threading.Thread(target=pay), threading.Thread(target=cancel)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Exactly one side wins, and a payment always ends with its seat
+        assert outcome['paid'] != outcome['cancelled']
+        sold = payment_system.revenue_by_tier().get('standard', {}).get('seats', 0)
+        if outcome['paid']:
+            assert booking.confirm_booking(session_id)[1] == 200
+            assert sold == sold_before + 1
+        else:
+            assert booking.confirm_booking(session_id)[1] == 404
+            assert sold == sold_before
+
+
+def test_cancelled_session_cannot_be_paid():
+    booking = TicketBooking()
+    hold, _ = booking.book('late', DATE)
+    session = payment_system.get_payment_session(hold['session_id'])
+    assert booking.cancel_hold(hold['session_id'], hold['cancel_token'])[1] == 200
+    assert session['status'] == 'cancelled'
+    assert payment_system.process_payment(hold['session_id']) == (False, "Invalid session ID")
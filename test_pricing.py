@@ -0,0 +1,46 @@
+import math
+
+import pytest
+
+from pricing import PriceTable
+from seat import TicketBooking
+
+
+@pytest.mark.parametrize('price', [math.nan, math.inf, -math.inf, 'nan', 'inf', 0, -5, True])
+def test_price_that_is_not_finite_and_positive_is_rejected(price):
+    booking = TicketBooking()
+    before = booking.prices()
+
+    result, status_code = booking.set_price_tiers([{'name': 'front', 'price': price, 'rows': [0, 1]}])
+
+    assert status_code == 400
+    assert 'front' in result['error']
+    assert booking.prices() == before
+
+
+def test_duplicate_tier_is_rejected():
+    booking = TicketBooking()
+    tiers = [
+        {'name': 'front', 'price': 80, 'rows': [0, 1]},
+        {'name': 'front', 'price': 1, 'rows': [2, 3]}
+    ]
+
+    result, status_code = booking.set_price_tiers(tiers)
+
+    assert status_code == 400
+    assert 'listed twice' in result['error']
+    with pytest.raises(ValueError):
+        PriceTable.from_config(10, 10, tiers)
+
+
+def test_valid_tiers_are_applied():
+    booking = TicketBooking()
+
+    result, status_code = booking.set_price_tiers([
+        {'name': 'front', 'price': 80, 'rows': [0, 1]},
+        {'name': 'standard', 'price': '30.5', 'rows': [2, 2]}
+    ])
+
+    assert status_code == 200
+    prices = {tier['name']: tier['price'] for tier in result['tiers']}
+    assert prices == {'standard': 30.5, 'front': 80.0}
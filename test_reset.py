@@ -0,0 +1,40 @@
+from payment import payment_system
+from seat import TicketBooking
+
+DATE = '2026-06-01'
+
+
+def test_hold_placed_between_seat_and_payment_resets_is_released(monkeypatch):
+    booking = TicketBooking()
+    booking.book('early', DATE)
+    reset_payments = payment_system.reset
+    gap = {}
+
+    def reset_with_hold_in_gap():
+        # Seats are already reset, payments not yet
+        gap['hold'] = booking.book('gap', DATE)
+        reset_payments()
+
+    monkeypatch.setattr(payment_system, 'reset', reset_with_hold_in_gap)
+    booking.reset()
+
+    assert gap['hold'][1] == 200
+    assert booking.get_available_count(DATE) == booking.capacity
+
+
+def test_hold_attached_after_a_payment_reset_is_refused(monkeypatch):
+    booking = TicketBooking()
+    booking.book('early', DATE)
+    create_session = payment_system.create_payment_session
+
+    def create_then_reset(*args, **kwargs):
+        created = create_session(*args, **kwargs)
+        # A reset lands before the seats are attached to the session
+        payment_system.reset()
+        return created
+
+    monkeypatch.setattr(payment_system, 'create_payment_session', create_then_reset)
+    result, status_code = booking.book('late', DATE)
+
+    assert status_code == 409
+    assert booking.get_available_count(DATE) == booking.capacity - 1
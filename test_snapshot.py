@@ -0,0 +1,51 @@
+import pytest
+
+from payment import payment_system
+from seat import TicketBooking
+from snapshot import Snapshotter
+from wal import WriteAheadLog
+
+DATE = '2026-06-01'
+
+
+@pytest.fixture(autouse=True)
+def detach_journal():
+    # recover() points the shared payment system at the test's journal
+    yield
+    payment_system.journal = None
+
+
+def test_hold_placed_after_a_reset_survives_snapshot_and_restart(tmp_path):
+    snapshot_path = str(tmp_path / 'seats.snapshot')
+    booking = TicketBooking()
+    booking.recover(WriteAheadLog(str(tmp_path / 'before.journal')))
+    booking.book('early', DATE)
+    booking.reset()
+    hold, _ = booking.book('late', DATE)
+    epoch = payment_system.epoch
+    Snapshotter(booking, payment_system, booking.journal, snapshot_path).take()
+
+    # A restart: fresh process state, rebuilt from the snapshot alone
+    payment_system.load([])
+    restarted = TicketBooking()
+    restarted.recover(WriteAheadLog(str(tmp_path / 'after.journal')), snapshot_path)
+
+    assert payment_system.epoch == epoch
+    assert payment_system.get_payment_session(hold['session_id'])['status'] == 'pending'
+    assert restarted.cancel_hold(hold['session_id'], hold['cancel_token'])[1] == 200
+    assert restarted.get_available_count(DATE) == restarted.capacity
+
+
+def test_reset_with_no_sessions_after_it_keeps_its_epoch(tmp_path):
+    snapshot_path = str(tmp_path / 'seats.snapshot')
+    booking = TicketBooking()
+    booking.recover(WriteAheadLog(str(tmp_path / 'before.journal')))
+    booking.book('early', DATE)
+    booking.reset()
+    epoch = payment_system.epoch
+    Snapshotter(booking, payment_system, booking.journal, snapshot_path).take()
+
+    payment_system.load([])
+    TicketBooking().recover(WriteAheadLog(str(tmp_path / 'after.journal')), snapshot_path)
+
+    assert payment_system.epoch == epoch
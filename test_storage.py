@@ -0,0 +1,19 @@
+from payment import payment_system
+from seat import TicketBooking
+from storage import inventory_factory
+
+DATE = '2026-06-01'
+
+
+def test_restart_frees_unpaid_seats_of_a_persistent_backend(tmp_path):
+    for backend, location in (("sqlite", str(tmp_path / "seats.db")), ("shared", str(tmp_path / "seats"))):
+        booking = TicketBooking(inventory_factory=inventory_factory(backend, location))
+        held, _ = booking.book('unpaid', DATE)
+        paid, _ = booking.book('paid', DATE)
+        payment_system.process_payment(paid['session_id'])
+        booking.confirm_booking(paid['session_id'])
+
+        restarted = TicketBooking(inventory_factory=inventory_factory(backend, location))
+        assert restarted.release_stored_holds() == 1
+        assert restarted.get_available_count(DATE) == restarted.capacity - 1
+        assert restarted.get_booked_count(DATE) == 1
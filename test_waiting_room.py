@@ -0,0 +1,27 @@
+import time
+
+from waiting_room import WaitingRoom
+
+
+def test_polling_an_admitted_ticket_returns_the_same_single_use_token(monkeypatch):
+    room = WaitingRoom(admit_per_second=100)
+    queue_token = room.enter()["queue_token"]
+    time.sleep(0.05)
+
+    # Every poll, by the client or anyone it shares the queue token with,
+    # gets the same admission token back, however much later
+    first = room.status(queue_token)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 5)
+    second = room.status(queue_token)
+    assert first["admitted"]
+    assert second["admission_token"] == first["admission_token"]
+    assert room.admit(first["admission_token"])
+    assert not room.admit(second["admission_token"])
+
+
+def test_queue_tokens_expire():
+    room = WaitingRoom(admit_per_second=100, token_ttl=60)
+    assert room.status(room._sign(f"q.0.{int(time.time()) - 1}")) is None
+    # Queue tokens from before they carried an expiry are refused
+    assert room.status(room._sign("q.0")) is None
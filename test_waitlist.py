@@ -0,0 +1,12 @@
+from waitlist import Waitlist
+
+
+def test_same_name_from_another_client_gets_its_own_entry():
+    waitlist = Waitlist('2026-06-01')
+    mine = waitlist.join('Sam', 1, False, client='10.0.0.1')
+    theirs = waitlist.join('Sam', 1, False, client='10.0.0.2')
+
+    assert theirs['waitlist_id'] != mine['waitlist_id']
+    assert theirs['position'] == 2
+    # Joining again from the same client finds the entry already waiting
+    assert waitlist.join('Sam', 1, False, client='10.0.0.1')['waitlist_id'] == mine['waitlist_id']
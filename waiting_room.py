@@ -0,0 +1,127 @@
+import hashlib
+import heapq
+import hmac
+import math
+import os
+import threading
+import time
+
+
+class WaitingRoom:
+    """Meters clients into the booking routes at a fixed rate
+
+    Every arriving client takes the next ticket number and gets it back as
+    a signed queue token. Tickets are admitted in order, ``admit_per_second``
+    of them per second; an admitted client exchanges its queue token for an
+    admission token. Both tokens carry an HMAC, so a forged one costs a
+    hash and a compare, and both expire ``token_ttl`` seconds after the
+    ticket's turn comes. A ticket has exactly one admission token, derived
+    from the queue token, so polling again (in any worker) hands back the
+    same one rather than minting more. An admission token buys one
+    booking: ``admit`` spends it, so one admitted client can't pass it
+    round the crowd, and ``refund`` gives it back when the attempt held
+    nothing. Spent tokens are remembered per process until they expire. Unused admission slots carry over for one second at most, so
+    a quiet room lets clients straight through while a burst after a
+    quiet spell is still let in at the configured rate.
+    """
+
+    def __init__(self, admit_per_second, token_ttl=300, secret=None):
+        self.admit_per_second = admit_per_second
+        self.token_ttl = token_ttl
+        # Several worker processes must share the secret to accept each
+        # other's tokens
+        self.secret = secret or os.urandom(32)
+        self.issued = 0  # tickets handed out
+        self.admitted = 0.0  # tickets below this are admitted, issued or not
+        self.updated_at = time.monotonic()
+        self.spent = set()  # admission tokens already used for a booking
+        self.spent_expiry = []  # heap of (expires_at, token) to forget them
+        self.lock = threading.Lock()
+
+    def _sign(self, payload):
+        signature = hmac.new(self.secret, payload.encode(), hashlib.sha256).hexdigest()
+        return f"{payload}.{signature}"
+
+    def _verify(self, token, kind):
+        """The dot-separated fields of a token of ``kind``, or None if forged"""
+        payload, _, signature = (token or "").rpartition(".")
+        fields = payload.split(".")
+        if fields[0] != kind or not hmac.compare_digest(self._sign(payload).encode(), token.encode()):
+            return None
+        return fields[1:]
+
+    def _advance(self):
+        """Admit the tickets whose turn came since the last call (caller holds the lock)"""
+        now = time.monotonic()
+        self.admitted = min(self.issued + self.admit_per_second,
+                            self.admitted + (now - self.updated_at) * self.admit_per_second)
+        self.updated_at = now
+
+    def enter(self):
+        """Take a place in the queue; returns the same shape as ``status``"""
+        with self.lock:
+            self._advance()
+            ticket = self.issued
+            self.issued += 1
+            # Tickets are admitted at a steady rate, so the turn is known now
+            turn = time.time() + max(0.0, ticket + 1 - self.admitted) / self.admit_per_second
+        return self.status(self._sign(f"q.{ticket}.{math.ceil(turn) + self.token_ttl}"))
+
+    def status(self, queue_token):
+        """Position and estimated wait for a queue token
+
+        Once the ticket's turn has come the result carries the ticket's
+        ``admission_token`` instead. Returns None for a forged or expired
+        token.
+        """
+        fields = self._verify(queue_token, "q")
+        if fields is None or len(fields) != 2:
+            return None
+        ticket, expires_at = int(fields[0]), int(fields[1])
+        now = time.time()
+        if expires_at <= now:
+            return None
+        with self.lock:
+            self._advance()
+            ahead = ticket - math.floor(self.admitted)
+        if ahead < 0:
+            return {
+                "admitted": True,
+                "admission_token": self._sign(f"a.{ticket}.{expires_at}"),
+                "expires_in": int(expires_at - now)
+            }
+        return {
+            "admitted": False,
+            "queue_token": queue_token,
+            "position": ahead + 1,
+            "eta_seconds": math.ceil((ahead + 1) / self.admit_per_second),
+            # Polling more often than a ticket moves up gains nothing
+            "retry_after": max(1, min(10, math.ceil(ahead / self.admit_per_second / 10)))
+        }
+
+    def admit(self, admission_token):
+        """Spend an admission token on one booking attempt
+
+        Returns False if the token is forged, expired or already spent.
+        """
+        fields = self._verify(admission_token, "a")
+        if fields is None:
+            return False
+        now = time.time()
+        expires_at = int(fields[1])
+        if expires_at <= now:
+            return False
+        with self.lock:
+            # Expired tokens are refused on their expiry alone
+            while self.spent_expiry and self.spent_expiry[0][0] <= now:
+                self.spent.discard(heapq.heappop(self.spent_expiry)[1])
+            if admission_token in self.spent:
+                return False
+            self.spent.add(admission_token)
+            heapq.heappush(self.spent_expiry, (expires_at, admission_token))
+        return True
+
+    def refund(self, admission_token):
+        """Make a spent token usable again after an attempt that held no seats"""
+        with self.lock:
+            self.spent.discard(admission_token)
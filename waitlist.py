@@ -0,0 +1,141 @@
+import threading
+import uuid
+from collections import deque
+
+# Promoted, failed or abandoned entries kept per show date for status polls
+FINISHED_ENTRIES_KEPT = 10000
+
+
+class Waitlist:
+    """First come, first served queue for a sold-out show date
+
+    Customers who find no seats join once and wait, instead of retrying
+    the booking endpoint. Freed seats are offered in queue order by
+    ``promote``, which reserves them on the customer's behalf; an entry
+    the free seats don't fit keeps its place without holding up smaller
+    requests behind it. Every entry takes a ticket number when it joins,
+    so a position is the distance to the head's ticket rather than a walk
+    through the queue. Entries that leave or are served out of turn are
+    only marked and dropped once they reach the head, so positions count
+    them until then and are an upper bound.
+    """
+
+    def __init__(self, date):
+        self.date = date
+        self.queue = deque()  # entries in joining order, some no longer waiting
+        self.entries = {}  # waitlist_id -> entry, waiting or recently finished
+        self.finished = deque()  # ids of finished entries, oldest first
+        self.customers = {}  # (name, client) -> the customer's waiting entry
+        self.tickets = 0  # tickets handed out so far
+        self.waiting = 0
+        self.serving = None  # head entry whose seats are being reserved
+        self.lock = threading.Lock()
+        # Promotions run one at a time so the head is never served twice
+        self.promote_lock = threading.Lock()
+
+    def join(self, name, quantity, best, client=None):
+        """Queue a customer, or return their entry if they already wait
+
+        Names are free text, so only the same name from the same client
+        counts as the same customer; anyone else gets an entry of their own
+        rather than the id of someone else's.
+        """
+        with self.lock:
+            entry = self.customers.get((name, client))
+            if entry is None:
+                entry = {
+                    "waitlist_id": uuid.uuid4().hex,
+                    "name": name,
+                    "date": self.date,
+                    "quantity": quantity,
+                    "best": best,
+                    "client": client,
+                    "ticket": self.tickets,
+                    "status": "waiting"
+                }
+                self.tickets += 1
+                self.waiting += 1
+                self.queue.append(entry)
+                self.entries[entry["waitlist_id"]] = entry
+                self.customers[(name, client)] = entry
+            return self._view(entry)
+
+    def status(self, waitlist_id):
+        """An entry with its current position, or None if unknown"""
+        with self.lock:
+            entry = self.entries.get(waitlist_id)
+            return None if entry is None else self._view(entry)
+
+    def leave(self, waitlist_id):
+        """Take a waiting entry out of the queue
+
+        Returns False if it isn't waiting any more, or is being handed
+        seats at this moment.
+        """
+        with self.lock:
+            entry = self.entries.get(waitlist_id)
+            if entry is None or entry["status"] != "waiting" or entry is self.serving:
+                return False
+            self._finish(entry, "left")
+            return True
+
+    def promote(self, hold):
+        """Hand free seats to waiting customers in queue order
+
+        ``hold(entry)`` tries to reserve the entry's seats and returns
+        ``(result, status_code)`` like ``TicketBooking.reserve_seat``. A
+        200 without success means the free seats don't fit the entry: it
+        keeps its place and the pass moves on to smaller requests behind
+        it, since a group that didn't fit means no larger one will. Other
+        failures (quota, payment errors) drop the entry. Returns the
+        promoted entries.
+        """
+        promoted = []
+        with self.promote_lock:
+            with self.lock:
+                waiting = [entry for entry in self.queue if entry["status"] == "waiting"]
+            too_big = None  # smallest group size found not to fit in this pass
+            for entry in waiting:
+                if too_big is not None and entry["quantity"] >= too_big:
+                    continue
+                with self.lock:
+                    if entry["status"] != "waiting":
+                        continue  # left since the pass started
+                    self.serving = entry
+                result, status_code = hold(entry)
+                with self.lock:
+                    self.serving = None
+                    if result.get("success"):
+                        self._finish(entry, "promoted", session_id=result["session_id"],
+                                     payment_url=result["payment_url"], seats=result["seats"])
+                        promoted.append(self._view(entry))
+                    elif status_code == 200:
+                        too_big = entry["quantity"]
+                    else:
+                        self._finish(entry, "failed", message=result.get("message", result.get("error")))
+                if too_big == 1:
+                    break  # not a single seat left
+        return promoted
+
+    def _head(self):
+        """The oldest waiting entry (caller holds the lock)"""
+        while self.queue and self.queue[0]["status"] != "waiting":
+            self.queue.popleft()
+        return self.queue[0] if self.queue else None
+
+    def _finish(self, entry, status, **fields):
+        """Move an entry out of the waiting state (caller holds the lock)"""
+        entry["status"] = status
+        entry.update(fields)
+        self.waiting -= 1
+        del self.customers[(entry["name"], entry["client"])]
+        self.finished.append(entry["waitlist_id"])
+        if len(self.finished) > FINISHED_ENTRIES_KEPT:
+            del self.entries[self.finished.popleft()]
+
+    def _view(self, entry):
+        """A copy of an entry for callers, with its position if waiting (caller holds the lock)"""
+        view = {key: value for key, value in entry.items() if key not in ("ticket", "client")}
+        if entry["status"] == "waiting":
+            view["position"] = entry["ticket"] - self._head()["ticket"] + 1
+        return view
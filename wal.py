@@ -0,0 +1,202 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class WriteAheadLog:
+    """Append-only journal of seat and payment transitions with group commit
+
+    Records are JSON lines appended to an in-memory batch. One background
+    thread writes the batch and makes it durable with a single ``fsync``,
+    so however many bookings arrive while a flush is in progress they all
+    share the next one.
+
+    With ``sync_interval_ms`` at 0 every ``sync()`` waits until the
+    records appended before it are on disk. With a positive interval the
+    batch is flushed at most that often and ``sync()`` returns at once,
+    trading the last few milliseconds of bookings on a crash for latency.
+
+    ``rotate()`` moves everything logged so far into a previous segment
+    that a snapshot can make redundant; until ``discard_previous()`` is
+    called it is still replayed ahead of the current file.
+
+    Only one process may use a journal at a time: two would replay,
+    append and rotate over each other. The journal is locked for as long
+    as the object lives and a second process fails at construction.
+    """
+
+    def __init__(self, path, sync_interval_ms=0):
+        self.path = path
+        self.sync_interval = sync_interval_ms / 1000
+        self.previous_path = path + '.prev'
+        # A file of its own, since rotation replaces the journal file
+        self.lock_file = open(path + '.lock', 'ab')
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise RuntimeError(f"Journal {path} is in use by another process") from None
+        self.file = open(path, 'ab')
+        # Serializes writes to the file against rotation
+        self.io_lock = threading.RLock()
+        self.batch = []  # encoded records not yet written
+        self.appended = 0  # sequence number of the last appended record
+        self.durable = 0  # sequence number of the last record on disk
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        # Threads inside deferred_sync(), whose sync() calls wait for the block
+        self.local = threading.local()
+
+    def append(self, op, **fields):
+        """Queue one transition for the next flush and return its sequence number"""
+        fields["op"] = op
+        line = json.dumps(fields, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self.condition:
+            self.batch.append(line)
+            self.appended += 1
+            self.condition.notify_all()
+            return self.appended
+
+    def sync(self):
+        """Wait until everything appended so far is durable
+
+        Returns at once when flushing on an interval. Callers append under
+        their own locks and sync after releasing them, so waiting for the
+        disk never holds up other reservations.
+        """
+        if self.sync_interval or getattr(self.local, "deferred", False):
+            return
+        with self.condition:
+            target = self.appended
+            while self.durable < target and self.running:
+                self.condition.wait()
+
+    @contextmanager
+    def deferred_sync(self):
+        """Let this thread's ``sync()`` calls return at once, then sync once
+
+        For a thread applying a batch of transitions: all of them share a
+        single wait for the disk at the end of the block instead of one
+        each.
+        """
+        self.local.deferred = True
+        try:
+            yield
+        finally:
+            self.local.deferred = False
+        self.sync()
+
+    def replay(self):
+        """Yield every complete record in the log, oldest first
+
+        The previous segment, if one is left, comes first. A record cut
+        short by a crash ends the replay of its file and is truncated away
+        so new records are not appended after a torn line.
+        """
+        self.file.flush()
+        if os.path.exists(self.previous_path):
+            yield from self._read(self.previous_path)
+        yield from self._read(self.path)
+
+    def _read(self, path):
+        valid = 0
+        with open(path, 'rb') as log:
+            for line in log:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("torn record")
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring journal tail after byte {valid} of {path}")
+                    break
+                valid += len(line)
+                yield record
+        if os.path.getsize(path) > valid:
+            os.truncate(path, valid)
+
+    def rotate(self):
+        """Close the current file as the previous segment and start a new one
+
+        Everything appended before the call is flushed into the previous
+        segment. If an earlier segment was never discarded (its snapshot
+        failed) the current file is appended to it instead, so no record
+        is lost.
+        """
+        with self.io_lock:
+            self._flush(*self._take())
+            self.file.close()
+            if os.path.exists(self.previous_path):
+                with open(self.path, 'rb') as current, open(self.previous_path, 'ab') as previous:
+                    previous.write(current.read())
+                    previous.flush()
+                    os.fsync(previous.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.previous_path)
+            self.file = open(self.path, 'ab')
+
+    def discard_previous(self):
+        """Delete the previous segment once a snapshot covers it"""
+        with self.io_lock:
+            if os.path.exists(self.previous_path):
+                os.remove(self.previous_path)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="write-ahead-log", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.io_lock:
+            self._flush(*self._take())
+
+    def _take(self):
+        with self.condition:
+            batch, self.batch = self.batch, []
+            return batch, self.appended
+
+    def _flush(self, batch, upto):
+        """Write and fsync one batch (caller holds the io lock)"""
+        if batch:
+            self.file.write(b''.join(batch))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        with self.condition:
+            self.durable = upto
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.batch:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            if self.sync_interval:
+                # Let an interval's worth of transitions pile up first
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, self.sync_interval)
+            with self.io_lock:
+                batch, upto = self._take()
+                try:
+                    self._flush(batch, upto)
+                except Exception:
+                    logger.exception("Failed to flush the write-ahead log, retrying")
+                    with self.condition:
+                        # Keep the records and their waiters for the next attempt
+                        self.batch[:0] = batch
+                        self.condition.wait(1)